@@ -1,31 +1,143 @@
 import pandas as pd
 import numpy as np
 from numpy.random import seed
-from sklearn import svm
-from sklearn.model_selection import GridSearchCV
-import matplotlib.pyplot as plt
 import datetime as dt
-import pandas_datareader as web
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
-from keras.layers import LSTM
-from keras import Sequential
-from sklearn.metrics import confusion_matrix, classification_report, roc_curve, auc
-from sklearn.preprocessing import OneHotEncoder
-import statsmodels.api as sm
-from sklearn.preprocessing import MinMaxScaler
 import math
-
-# Display options
-pd.set_option("display.max_rows", None, "display.max_columns", None)
-
-#seed
-seed(100)
-tf.random.set_seed(100)
-
-#computes indicators
-def indicators(data):
+import importlib
+import importlib.util
+import copy
+import warnings
+import sys
+import io
+import contextlib
+import argparse
+import platform
+import resource
+import subprocess
+import zlib
+import functools
+import threading
+import atexit
+import tempfile
+import shutil
+import itertools
+from functools import partial
+import tracemalloc
+import pickle
+import hashlib
+import os
+import json
+from urllib.parse import quote
+import time
+import multiprocessing
+from multiprocessing import Pool
+from collections import deque
+from numpy.lib.stride_tricks import sliding_window_view
+
+# module imported on its first use, keeps tensorflow, statsmodels, matplotlib, sklearn, scipy and pandas_datareader
+# out of the import of this file (indicators, features and backtests only load what they call)
+class LazyModule:
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+plt = LazyModule('matplotlib.pyplot')
+mpl_figure = LazyModule('matplotlib.figure')
+mdates = LazyModule('matplotlib.dates')
+web = LazyModule('pandas_datareader')
+tf = LazyModule('tensorflow')
+keras = LazyModule('tensorflow.keras')
+layers = LazyModule('tensorflow.keras.layers')
+sm = LazyModule('statsmodels.api')
+signal = LazyModule('scipy.signal')
+svm = LazyModule('sklearn.svm')
+model_selection = LazyModule('sklearn.model_selection')
+metrics = LazyModule('sklearn.metrics')
+preprocessing = LazyModule('sklearn.preprocessing')
+sklearn_base = LazyModule('sklearn.base')
+
+# Instrumentation: wall time, CPU time, memory and rows of each stage, exported as a chrome trace (chrome://tracing)
+# switched on by PYPROJECT_TRACE=trace.json, --trace trace.json or enable_trace(); when off a traced call is one extra check
+_trace = None # chrome trace events while tracing is on
+_trace_start = 0
+def enable_trace(path = None):
+    global _trace, _trace_start
+
+    _trace = []
+    _trace_start = time.perf_counter()
+
+    if path is not None:
+        atexit.register(save_trace, path)
+def save_trace(path):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': _trace, 'displayTimeUnit': 'ms'}, f)
+# resident memory now and at its peak (MB)
+def memory_usage():
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError: # not linux
+        rss = np.nan
+
+    return rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+def _rows(x):
+    if isinstance(x, tuple) and len(x) > 0:
+        x = x[0]
+    if isinstance(x, str):
+        return None
+    try:
+        return len(x)
+    except TypeError:
+        return None
+def _trace_event(name, t0, cpu0, args):
+    rss, max_rss = memory_usage()
+    args.update({'cpu_ms': (time.process_time() - cpu0) * 1000, 'rss_mb': rss, 'max_rss_mb': max_rss})
+
+    _trace.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                   'ts': (t0 - _trace_start) * 1e6, 'dur': (time.perf_counter() - t0) * 1e6, 'args': args})
+# decorator recording every call of a stage function, rows = length of the first argument and of the result
+def traced(func):
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _trace is None:
+            return func(*args, **kwargs)
+
+        t0, cpu0 = time.perf_counter(), time.process_time()
+        result = func(*args, **kwargs)
+        _trace_event(name, t0, cpu0, {'rows_in': _rows(args[1:] if name.endswith('__call__') else args), 'rows_out': _rows(result)})
+
+        return result
+
+    return wrapper
+# context manager recording a block of the script (model fits and predictions)
+class stage:
+
+    def __init__(self, name, rows = None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        if _trace is not None:
+            self.t0, self.cpu0 = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        if _trace is not None:
+            _trace_event(self.name, self.t0, self.cpu0, {'rows': self.rows})
+if os.environ.get('PYPROJECT_TRACE'):
+    enable_trace(os.environ['PYPROJECT_TRACE'])
+
+#computes indicators (original loop version, kept as reference for indicators_parity)
+def indicators_loop(data):
 
     # Relative Strength Index
     def RSI(data, n):
@@ -265,7 +377,803 @@ def indicators(data):
     X = pd.DataFrame(df) # coercing indicators into dataframe
 
     return X
+
+
+# sum of every window of n consecutive values of x (len(x) - n + 1 windows)
+# kept strided (O(len(x) * n)) for RSI, Bollinger and MACD, whose windows are at most a few dozen bars: each sum only
+# reads its own n values, so a bar's indicators do not depend on where its history starts (prefix sums drift by ~1e-6
+# over 10 ** 7 bars of prices) and the chunked and streaming paths reproduce them without carrying sums. running_sum
+# is ~4x faster at n = 27 and is used where the windows are the study's own averages of derived series (%D, adx)
+def rolling_sum(x, n):
+    return sliding_window_view(x, n).sum(axis = 1)
+
+
+# cumulative sums of x with a leading 0
+def prefix_sum(x):
+    prefix = np.zeros(len(x) + 1)
+    np.cumsum(x, out = prefix[1:])
+    return prefix
+
+
+# same windows as rolling_sum, from the prefix sums of x: one subtraction per window whatever n
+def window_sum(prefix, n):
+    return prefix[n:] - prefix[: len(prefix) - n]
+
+
+# rolling_sum in O(len(x)) from prefix sums; the windows holding a non-finite value (e.g. 0 / 0 on a flat stretch)
+# are summed directly, so a nan stays in the windows it is in instead of spreading through the prefix sums
+def running_sum(x, n):
+    finite = np.isfinite(x)
+
+    if finite.all():
+        return window_sum(prefix_sum(x), n)
+
+    sums = window_sum(prefix_sum(np.where(finite, x, 0)), n)
+    bad = window_sum(prefix_sum(~finite), n) > 0
+    sums[bad] = sliding_window_view(x, n)[bad].sum(axis = 1)
+
+    return sums
+
+
+# max (func = np.maximum) or min (np.minimum) of every window of n consecutive values in O(len(x)) whatever n
+# (van Herk / Gil-Werman): running extremes from both ends of blocks of n values, a window straddles at most two blocks
+def rolling_extreme(x, n, func):
+    blocks = -(-len(x) // n)
+    padded = np.full(blocks * n, -np.inf if func is np.maximum else np.inf)
+    padded[: len(x)] = x
+    padded = padded.reshape(blocks, n)
+
+    forward = func.accumulate(padded, axis = 1).ravel() # extreme from the start of the block
+    backward = func.accumulate(padded[:, ::-1], axis = 1)[:, ::-1].ravel() # extreme to the end of the block
+
+    return func(backward[: len(x) - n + 1], forward[n - 1 : len(x)])
+
+
+# Relative Strength Index (vectorized), aligned on the bars of the series
+def vec_RSI(close, n):
+    rsi = np.full(len(close), np.nan)
+
+    diff = 100 * ((close[1:] - close[:-1]) / close[:-1])
+
+    u = (1 / (n + 1)) * rolling_sum(np.where(diff > 0, diff, 0), n)
+    d = (1 / (n + 1)) * rolling_sum(np.where(diff < 0, -diff, 0), n)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        rsi[n:] = 100 - (100 / (1 + (u / d)))
+
+    return rsi
+
+
+# Stochastic Oscillator (vectorized), %K on n + 1 closes and its d-days average
+# high, low: %K against the range of the highs and lows instead of the closes
+def vec_oscill(close, n, d, high = None, low = None):
+    K = np.full(len(close), np.nan)
+    ma = np.full(len(close), np.nan)
+
+    if len(close) <= n:
+        return K, ma
+
+    highest = rolling_extreme(close if high is None else high, n + 1, np.maximum)
+    lowest = rolling_extreme(close if low is None else low, n + 1, np.minimum)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        K[n:] = ((close[n:] - lowest) / (highest - lowest)) * 100
+
+    if len(close) > n + d:
+        ma[n + d:] = (1 / d) * running_sum(K[n:], d + 1) # d + 1 values divided by d, as in the loop version
+
+    return K, ma
+
+
+# Bollinger Bands (vectorized), population sd over n + 1 closes
+# reference: value the closes are centered on (the first close by default, known before the rest of the series is read)
+def vec_boll(close, k, n, reference = None):
+    MA = np.full(len(close), np.nan)
+    sigma = np.full(len(close), np.nan)
+
+    centered = close - (close[0] if reference is None else reference) # centering limits cancellation in E[x^2] - E[x]^2
+    mean = (1 / (n + 1)) * rolling_sum(centered, n + 1)
+    var = (1 / (n + 1)) * rolling_sum(centered ** 2, n + 1) - mean ** 2
+
+    MA[n:] = (1 / (n + 1)) * rolling_sum(close, n + 1)
+    sigma[n:] = np.sqrt(np.maximum(var, 0))
+
+    return MA, MA + (k * sigma), MA - (k * sigma)
+
+
+# Moving Average Convergence Divergence (vectorized)
+def vec_MACD(close, n_large, n_small):
+    ma_small = np.full(len(close), np.nan)
+    ma_large = np.full(len(close), np.nan)
+
+    # the loop version never clears its window lists, so each value is the running total of all windows so far
+    ma_small[n_small:] = (1 / (n_small + 1)) * np.cumsum(rolling_sum(close[:-1], n_small))
+    ma_large[n_large:] = (1 / (n_small + 1)) * np.cumsum(rolling_sum(close[:-1], n_large))
+
+    return ma_small, ma_large
+
+
+# Wilder smoothing: n-days sum at bar n, then s[p] = s[p - 1] - s[p - 1] / n + x[p]
+def wilder(x, n):
+    smooth = np.zeros(len(x))
+
+    if len(x) <= n:
+        return smooth
+
+    smooth[n] = x[0 : n].sum()
+    a = 1 - (1 / n)
+    smooth[n + 1:] = signal.lfilter([1], [1, -a], x[n + 1:], zi = [a * smooth[n]])[0]
+
+    return smooth
+
+
+# Average Directional Index (vectorized)
+def vec_ADX(high, low, close, n):
+    return vec_DMI(high, low, close, n)[0]
+
+
+# Directional Movement Index: n-days ADX, +DI and -DI (as the study defines them: smoothed movement over the bar's true range)
+# jit: single-pass kernel compiled by numba (optional dependency). Its running-sum dx average rounds differently from the
+# prefix sums of ADX_smooth (last bits), so the numpy passes stay the default and features do not depend on what is installed
+# causal: adx averaging the dx of the bar and the n - 1 before it (see ADX_smooth)
+def vec_DMI(high, low, close, n, jit = False, causal = False):
+    if not jit:
+        return ADX_smooth(*ADX_inputs(high, low, close), n, causal)
+
+    if causal:
+        raise ValueError("the numba kernel computes the study's adx only")
+
+    kernel = DMI_kernel()
+    if kernel is None:
+        raise ImportError('vec_DMI(jit = True) needs numba')
+
+    adx, DI_plus, DI_minus = np.zeros(len(close)), np.zeros(len(close)), np.zeros(len(close))
+    kernel(np.ascontiguousarray(high), np.ascontiguousarray(low), np.ascontiguousarray(close), n, adx, DI_plus, DI_minus)
+
+    return adx, DI_plus, DI_minus
+
+
+# vec_DMI in one loop over the bars, for the compiler: true range, movements, Wilder smoothing and directional indicators,
+# then the n-days average of dx as a running sum (a window holding a non-finite dx is summed directly, as rolling_sum does)
+def DMI_loop(high, low, close, n, adx, DI_plus, DI_minus):
+    length = len(close)
+    dx = np.zeros(length + 5) # five zeros, then the dx of bars n, n + 1, ... (see ADX_smooth)
+    true_range = np.float64(0.0)
+    smooth_plus = np.float64(0.0)
+    smooth_minus = np.float64(0.0)
+    a = 1 - (1 / n)
+
+    for p in range(length):
+        if p > 0:
+            bar_range = max(abs(high[p] - low[p]), abs(high[p] - close[p - 1]), abs(low[p] - close[p - 1]))
+            if bar_range != 0: # a zero range carries the previous one forward
+                true_range = bar_range
+
+        up = high[p] - high[p - 1] # bar 0 is compared with the last bar, as in the loop version
+        down = low[p - 1] - low[p]
+        plus = up if up > down else 0.0
+        minus = 0.0 if up > down else down
+
+        if p < n: # the first n movements are summed, smoothing starts at bar n
+            smooth_plus += plus
+            smooth_minus += minus
+        elif p > n:
+            smooth_plus = a * smooth_plus + plus
+            smooth_minus = a * smooth_minus + minus
+
+        if p > 0:
+            DI_plus[p] = ((smooth_plus if p >= n else 0.0) / true_range) * 100
+            DI_minus[p] = ((smooth_minus if p >= n else 0.0) / true_range) * 100
+
+        if p >= n:
+            dx[p - n + 5] = abs((DI_plus[p] - DI_minus[p]) / (DI_plus[p] + DI_minus[p])) * 100
+
+    total = 0.0
+    bad = 0
+    for p in range(n, length):
+        for q in (range(p) if p == n else range(p - 1, p)): # the first window, then the value entering it
+            if np.isfinite(dx[q]):
+                total += dx[q]
+            else:
+                bad += 1
+        if p > n:
+            if np.isfinite(dx[p - 1 - n]):
+                total -= dx[p - 1 - n]
+            else:
+                bad -= 1
+
+        adx[p] = (1 / n) * (total if bad == 0 else dx[p - n : p].sum())
+
+
+_DMI_jit = None # DMI_loop compiled on first use, False when numba is missing
+def DMI_kernel():
+    global _DMI_jit
+
+    if _DMI_jit is None:
+        if importlib.util.find_spec('numba') is not None:
+            _DMI_jit = importlib.import_module('numba').njit(cache = True, error_model = 'numpy')(DMI_loop)
+        else:
+            _DMI_jit = False
+
+    return _DMI_jit or None
+
+
+# true range and directional movements of every bar (they do not depend on the ADX length)
+def ADX_inputs(high, low, close):
+    true_range = np.zeros(len(close))
+    true_range[1:] = np.maximum.reduce([np.abs(high[1:] - low[1:]),
+                                        np.abs(high[1:] - close[:-1]),
+                                        np.abs(low[1:] - close[:-1])])
+
+    # a zero range carries the previous one forward
+    filled = np.where(true_range != 0, np.arange(len(close)), 0)
+    true_range = true_range[np.maximum.accumulate(filled)]
+
+    up = high - np.roll(high, 1) # bar 0 is compared with the last bar, as in the loop version
+    down = np.roll(low, 1) - low
+    DM_plus = np.where(up > down, up, 0)
+    DM_minus = np.where(up > down, 0, down)
+
+    return true_range, DM_plus, DM_minus
+
+
+# n-days ADX, +DI and -DI from the output of ADX_inputs: Wilder smoothing by a recursive filter, dx average from prefix sums
+# the study's adx of bar p averages the dx of bars p - 5 to p + n - 6 (zeros past the last bar), causal: the dx of bars
+# p - n + 1 to p (zeros before bar n), as ADXStream, so the adx of the latest bar is known when it closes
+def ADX_smooth(true_range, DM_plus, DM_minus, n, causal = False):
+    if causal: # no movement on bar 0 (the study compares it with the last bar of the series)
+        DM_plus, DM_minus = np.concatenate([[0], DM_plus[1:]]), np.concatenate([[0], DM_minus[1:]])
+
+    smooth_plus = wilder(DM_plus, n)
+    smooth_minus = wilder(DM_minus, n)
+
+    indicator_plus = np.zeros(len(true_range))
+    indicator_minus = np.zeros(len(true_range))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        indicator_plus[1:] = (smooth_plus[1:] / true_range[1:]) * 100
+        indicator_minus[1:] = (smooth_minus[1:] / true_range[1:]) * 100
+
+        dx = (np.abs((indicator_plus[n:] - indicator_minus[n:]) / (indicator_plus[n:] + indicator_minus[n:]))) * 100
+
+    adx = np.zeros(len(true_range))
+
+    if causal:
+        adx[n:] = (1 / n) * running_sum(np.concatenate([np.zeros(n - 1), dx]), n)
+        return adx, indicator_plus, indicator_minus
+
+    # dx starts with five zeros and is zero-padded so every n-days window fits
+    dx = np.concatenate([np.zeros(5), dx, np.zeros(max(0, n - 5))])
+
+    adx[n:] = (1 / n) * running_sum(dx[: len(true_range) - 1], n)
+
+    return adx, indicator_plus, indicator_minus
+
+
+# On-Balance Volume (vectorized)
+def vec_OBV(close, volume):
+    obv = np.zeros(len(close), dtype = volume.dtype)
+
+    diff = close[1:] - close[:-1]
+    obv[1:] = np.cumsum(np.where(diff > 0, volume[1:], np.where(diff < 0, -volume[1:], 0)))
+
+    return obv
+
+
+# indicator parameters of the study (indicator_arrays, indicators and features take a dict overriding some of them)
+# so_high_low: stochastic %K against the highs and lows instead of the closes
+# adx_causal: adx from the dx of the bar and the ones before it (ADXStream) instead of the study's window reaching ahead
+INDICATOR_PARAMS = {'rsi': 9, 'so': 14, 'ma_so': 5, 'ma': 20, 'sd_boll': 2, 'macd_small': 12, 'macd_large': 26, 'adx_length': 14,
+                    'so_high_low': False, 'adx_causal': False}
+# indicators of the study, in the order of indicators()
+INDICATOR_COLUMNS = ['RSI', 'D', 'MA', 'boll_up', 'boll_dw', 'MACD_short', 'MACD_long', 'adx', 'OBV']
+# full parameter set: the defaults updated with params
+def indicator_params(params = None):
+    full = dict(INDICATOR_PARAMS)
+
+    if params is not None:
+        unknown = set(params) - set(INDICATOR_PARAMS)
+        if len(unknown) > 0:
+            raise ValueError('unknown indicator parameters: ' + ', '.join(sorted(unknown)))
+        full.update(params)
+
+    return full
+# every indicator as full-length arrays aligned on the bars, and the first bar where they are all defined
+def indicator_arrays(data, params = None):
+    close = data['Adj Close'].to_numpy(dtype = float)
+    high = data['High'].to_numpy(dtype = float)
+    low = data['Low'].to_numpy(dtype = float)
+    volume = data['Volume'].to_numpy()
+
+    p = indicator_params(params)
+
+    RSI = vec_RSI(close, p['rsi']) # 9-days RSI
+    if p['so_high_low']:
+        K, D = vec_oscill(close, p['so'], p['ma_so'], high, low) # 14-days SO on the high-low range & 5-days moving average
+    else:
+        K, D = vec_oscill(close, p['so'], p['ma_so']) # 14-days SO & 5-days moving average
+    MA, boll_up, boll_dw = vec_boll(close, p['sd_boll'], p['ma']) # 20-days MA and 2-sd bollinger bands
+    macd_short, macd_long = vec_MACD(close, p['macd_large'], p['macd_small']) # 12 & 26 days moving averages
+    adx, DI_plus, DI_minus = vec_DMI(high, low, close, p['adx_length'], causal = p['adx_causal']) # 14 days ADX & positive and negative indicators
+    obv = vec_OBV(close, volume) # On Balance Volume
+
+    arrays = {'RSI': RSI, 'D': D, 'MA': MA, 'boll_up': boll_up,
+              'boll_dw': boll_dw, 'MACD_short' : macd_short, 'MACD_long' : macd_long,
+              'adx' : adx, 'OBV' : obv, 'DI_plus' : DI_plus, 'DI_minus' : DI_minus}
+
+    return arrays, indicator_warmup(p)
+# first bar where every indicator is defined (the longest MACD average with the study's parameters)
+def indicator_warmup(p):
+    return max(p['rsi'], p['so'] + p['ma_so'], p['ma'], p['macd_small'], p['macd_large'])
+#computes indicators
+@traced
+# columns: indicators kept (INDICATOR_COLUMNS, the study's, by default; DI_plus and DI_minus are also available)
+def indicators(data, params = None, columns = None):
+    arrays, warmup = indicator_arrays(data, params)
+
+    # removing NAs
+    df = {name : arrays[name][warmup:] for name in (INDICATOR_COLUMNS if columns is None else columns)}
+    X = pd.DataFrame(df) # coercing indicators into dataframe
+
+    return X
+# compares the vectorized indicators with the loop version, returns the largest relative gap per indicator
+def indicators_parity(data, rtol = 1e-8):
+    fast = indicators(data)
+    slow = indicators_loop(data)
+
+    gap = {}
+
+    for col in fast.columns:
+        a = fast[col].to_numpy(dtype = float)
+        b = slow[col].to_numpy(dtype = float)
+
+        assert np.allclose(a, b, rtol = rtol, atol = 1e-8, equal_nan = True), col
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            gap[col] = np.nanmax(np.abs(a - b) / np.maximum(np.abs(b), 1))
+
+    return pd.Series(gap)
+
+
+# Parameter sweep: the indicators of a whole grid of parameter sets in one pass
+# the prefix sums, the rolling max/min table and the ADX inputs are built once for the series, then each distinct
+# window length is computed once and shared by every parameter set that uses it
+# every combination of the values given per parameter, e.g. parameter_grid(rsi = [7, 9, 14], ma = [10, 20])
+def parameter_grid(**values):
+    names = list(values)
+    return [dict(zip(names, combo)) for combo in itertools.product(*[values[name] for name in names])]
+# sparse table of x: level k holds func (np.maximum / np.minimum) of every 2 ** k consecutive values, up to windows of `largest`
+def extremes_table(x, largest, func):
+    table = [x]
+    while 2 ** len(table) <= largest:
+        half = 2 ** (len(table) - 1)
+        table.append(func(table[-1][: len(table[-1]) - half], table[-1][half:]))
+    return table
+# func of every n consecutive values, from the two overlapping power-of-two windows covering them
+def window_extreme(table, n, func):
+    k = n.bit_length() - 1
+    level = table[k]
+    return func(level[: len(level) - (n - 2 ** k)], level[n - 2 ** k:])
+# indicators of every parameter set of grid (list of dicts, see parameter_grid and INDICATOR_PARAMS)
+# returns a (parameter set, bar, feature) array, the full parameter sets and the feature names; every set starts on
+# the first bar where all of them are defined, so sweep[i] is indicators(data, grid[i]) without its first rows
+@traced
+def indicator_sweep(data, grid, dtype = np.float64):
+    close = data['Adj Close'].to_numpy(dtype = float)
+    high = data['High'].to_numpy(dtype = float)
+    low = data['Low'].to_numpy(dtype = float)
+    volume = data['Volume'].to_numpy()
+
+    params = [indicator_params(p) for p in grid]
+    warmup = max(indicator_warmup(p) for p in params)
+    length = len(close)
+
+    # shared by every window length
+    diff = 100 * ((close[1:] - close[:-1]) / close[:-1])
+    gains, losses = prefix_sum(np.where(diff > 0, diff, 0)), prefix_sum(np.where(diff < 0, -diff, 0))
+    centered = close - close[0] # as vec_boll
+    sums, centered_sums, squared_sums = prefix_sum(close), prefix_sum(centered), prefix_sum(centered ** 2)
+    largest = max(p['so'] for p in params) + 1
+    ADX_bars = ADX_inputs(high, low, close)
+    obv = vec_OBV(close, volume)
+
+    def RSI(n):
+        rsi = np.full(length, np.nan)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            rsi[n:] = 100 - (100 / (1 + (window_sum(gains, n) / window_sum(losses, n))))
+        return rsi
+
+    def table(prices, func):
+        return extremes_table({'close': close, 'high': high, 'low': low}[prices], largest, func)
+
+    def K(n, high_low):
+        K = np.full(length, np.nan)
+        highest = window_extreme(cache(table, 'high' if high_low else 'close', np.maximum), n + 1, np.maximum)
+        lowest = window_extreme(cache(table, 'low' if high_low else 'close', np.minimum), n + 1, np.minimum)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            K[n:] = ((close[n:] - lowest) / (highest - lowest)) * 100
+        return K
+
+    def D(n, d, high_low):
+        ma = np.full(length, np.nan)
+        ma[n + d:] = (1 / d) * running_sum(cache(K, n, high_low)[n:], d + 1)
+        return ma
+
+    def bands(n):
+        MA = np.full(length, np.nan)
+        sigma = np.full(length, np.nan)
+        mean = (1 / (n + 1)) * window_sum(centered_sums, n + 1)
+        MA[n:] = (1 / (n + 1)) * window_sum(sums, n + 1)
+        sigma[n:] = np.sqrt(np.maximum((1 / (n + 1)) * window_sum(squared_sums, n + 1) - mean ** 2, 0))
+        return MA, sigma
+
+    def MACD(n, n_small):
+        ma = np.full(length, np.nan)
+        ma[n:] = (1 / (n_small + 1)) * np.cumsum(window_sum(sums[: length], n)) # running total, as vec_MACD
+        return ma
+
+    def ADX(n, causal):
+        return ADX_smooth(*ADX_bars, n, causal)[0]
+
+    computed = {} # (indicator, window lengths) -> arrays
+    def cache(func, *args):
+        if (func.__name__,) + args not in computed:
+            computed[(func.__name__,) + args] = func(*args)
+        return computed[(func.__name__,) + args]
+
+    sweep = np.empty((len(params), length - warmup, len(INDICATOR_COLUMNS)), dtype = dtype)
+    block = np.empty((len(INDICATOR_COLUMNS), length - warmup)) # one set, feature-major: contiguous writes, then one transposed copy
+
+    for i, p in enumerate(params):
+        MA, sigma = cache(bands, p['ma'])
+        MA, sigma = MA[warmup:], sigma[warmup:]
+
+        block[0] = cache(RSI, p['rsi'])[warmup:]
+        block[1] = cache(D, p['so'], p['ma_so'], p['so_high_low'])[warmup:]
+        block[2] = MA
+        np.multiply(sigma, p['sd_boll'], out = block[3])
+        np.subtract(MA, block[3], out = block[4])
+        block[3] += MA
+        block[5] = cache(MACD, p['macd_small'], p['macd_small'])[warmup:]
+        block[6] = cache(MACD, p['macd_large'], p['macd_small'])[warmup:]
+        block[7] = cache(ADX, p['adx_length'], p['adx_causal'])[warmup:]
+        block[8] = obv[warmup:]
+
+        sweep[i] = block.T
+
+    return sweep, params, INDICATOR_COLUMNS
+# checks every parameter set of the sweep against indicators(), returns the largest relative gap per feature
+def sweep_parity(data, grid, rtol = 1e-8):
+    sweep, params, names = indicator_sweep(data, grid)
+    gap = pd.Series(0.0, index = names)
+
+    for i, p in enumerate(params):
+        single = indicators(data, p)
+        single = single.iloc[len(single) - sweep.shape[1]:]
+
+        for j, col in enumerate(names):
+            a = sweep[i, :, j]
+            b = single[col].to_numpy(dtype = float)
+
+            assert np.allclose(a, b, rtol = rtol, atol = 1e-8, equal_nan = True), (p, col)
+
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                gap[col] = max(gap[col], np.nanmax(np.abs(a - b) / np.maximum(np.abs(b), 1)))
+
+    return gap
+
+
+# Streaming indicators: one object per indicator, updated bar by bar in O(1)
+class StreamingState:
+
+    def snapshot(self):
+        return copy.deepcopy(self.__dict__)
+
+    def restore(self, state):
+        self.__dict__.update(copy.deepcopy(state))
+        return self
+
+
+# sum of the last n pushed values, resynchronised every n pushes so rounding errors do not build up
+class RollingWindow(StreamingState):
+
+    def __init__(self, n):
+        self.n = n
+        self.values = deque(maxlen = n)
+        self.sum = 0.0
+        self.pushes = 0
+
+    def push(self, x):
+        if len(self.values) == self.n:
+            self.sum -= self.values[0]
+        self.values.append(x)
+        self.sum += x
+        self.pushes += 1
+
+        if self.pushes % self.n == 0:
+            self.sum = sum(self.values)
+
+        return self.sum
+
+    def full(self):
+        return len(self.values) == self.n
+
+
+# rolling max and min of the last n values with monotonic deques (amortized O(1))
+class RollingExtremes(StreamingState):
+
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+        self.highs = deque()
+        self.lows = deque()
+
+    # low: value entering the window of minimums when it differs from the one entering the maximums (e.g. a bar's high and low)
+    def push(self, x, low = None):
+        low = x if low is None else low
+
+        while self.highs and self.highs[-1][1] <= x:
+            self.highs.pop()
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+
+        self.highs.append((self.count, x))
+        self.lows.append((self.count, low))
+        self.count += 1
+
+        if self.highs[0][0] <= self.count - 1 - self.n:
+            self.highs.popleft()
+        if self.lows[0][0] <= self.count - 1 - self.n:
+            self.lows.popleft()
+
+        return self.highs[0][1], self.lows[0][1]
+
+
+# Relative Strength Index
+class RSIStream(StreamingState):
+
+    def __init__(self, n):
+        self.n = n
+        self.prev = None
+        self.up = RollingWindow(n)
+        self.down = RollingWindow(n)
+
+    def update(self, bar):
+        close = bar['Adj Close']
+
+        if self.prev is not None:
+            diff = 100 * ((close - self.prev) / self.prev)
+            self.up.push(diff if diff > 0 else 0)
+            self.down.push(-diff if diff < 0 else 0)
+
+        self.prev = close
+
+        if not self.up.full():
+            return np.nan
+
+        u = (1 / (self.n + 1)) * self.up.sum
+        d = (1 / (self.n + 1)) * self.down.sum
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return 100 - (100 / (1 + (np.float64(u) / d)))
+
+
+# Stochastic Oscillator, returns %K and its d-days average (high_low: %K against the range of the highs and lows)
+class OscillStream(StreamingState):
+
+    def __init__(self, n, d, high_low = False):
+        self.n = n
+        self.d = d
+        self.high_low = high_low
+        self.extremes = RollingExtremes(n + 1)
+        self.K = RollingWindow(d + 1)
+
+    def update(self, bar):
+        close = bar['Adj Close']
+        high, low = self.extremes.push(bar['High'], bar['Low']) if self.high_low else self.extremes.push(close)
+
+        if self.extremes.count <= self.n:
+            return np.nan, np.nan
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            K = ((close - low) / np.float64(high - low)) * 100
+
+        self.K.push(K)
+
+        if not self.K.full():
+            return K, np.nan
+
+        return K, (1 / self.d) * self.K.sum
+
+
+# Bollinger Bands, returns the moving average and both bands
+class BollStream(StreamingState):
+
+    def __init__(self, k, n):
+        self.k = k
+        self.n = n
+        self.shift = None
+        self.sum = RollingWindow(n + 1)
+        self.sum_sq = RollingWindow(n + 1)
+
+    def update(self, bar):
+        close = bar['Adj Close']
+
+        if self.shift is None:
+            self.shift = close # sums are kept around the first close to limit cancellation
+
+        self.sum.push(close - self.shift)
+        self.sum_sq.push((close - self.shift) ** 2)
+
+        if not self.sum.full():
+            return np.nan, np.nan, np.nan
+
+        mean = (1 / (self.n + 1)) * self.sum.sum
+        sigma = np.sqrt(max((1 / (self.n + 1)) * self.sum_sq.sum - mean ** 2, 0))
+        ma = mean + self.shift
+
+        return ma, ma + (self.k * sigma), ma - (self.k * sigma)
+
+
+# MACD averages, with the running totals of the batch version
+class MACDStream(StreamingState):
+
+    def __init__(self, n_large, n_small):
+        self.n_large = n_large
+        self.n_small = n_small
+        self.prev = None
+        self.small = RollingWindow(n_small)
+        self.large = RollingWindow(n_large)
+        self.total_small = 0.0
+        self.total_large = 0.0
+
+    def update(self, bar):
+        # windows end on the previous close
+        if self.prev is not None:
+            self.small.push(self.prev)
+            self.large.push(self.prev)
+
+            if self.small.full():
+                self.total_small += self.small.sum
+            if self.large.full():
+                self.total_large += self.large.sum
+
+        self.prev = bar['Adj Close']
+
+        ma_small = (1 / (self.n_small + 1)) * self.total_small if self.small.full() else np.nan
+        ma_large = (1 / (self.n_small + 1)) * self.total_large if self.large.full() else np.nan
+
+        return ma_small, ma_large
+
+
+# Average Directional Index with Wilder smoothing
+# The batch ADX wraps bar 0 onto the last bar and averages dx up to 8 bars ahead; the stream
+# can only look back, so bar 0 has no directional movement and the average covers the last n dx
+# (the batch ADX with adx_causal). DI_plus and DI_minus hold the directional indicators of the last bar.
+class ADXStream(StreamingState):
+
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+        self.prev = None
+        self.true_range = 0.0
+        self.smooth_plus = 0.0
+        self.smooth_minus = 0.0
+        self.DI_plus = 0.0
+        self.DI_minus = 0.0
+        self.dx = RollingWindow(n)
+
+    def update(self, bar):
+        high, low, close = bar['High'], bar['Low'], bar['Adj Close']
+        DM_plus = DM_minus = 0.0
+
+        if self.prev is not None:
+            prev_high, prev_low, prev_close = self.prev
+            true_range = max(abs(high - low), abs(high - prev_close), abs(low - prev_close))
+            if true_range != 0:
+                self.true_range = true_range
+
+            if (high - prev_high) > (prev_low - low):
+                DM_plus = high - prev_high
+            else:
+                DM_minus = prev_low - low
+
+        self.prev = (high, low, close)
+        p = self.count
+        self.count += 1
+
+        if p < self.n:
+            # first n movements are summed, smoothing starts at bar n
+            self.smooth_plus += DM_plus
+            self.smooth_minus += DM_minus
+            self.dx.push(0.0)
+            return 0.0
+
+        if p > self.n:
+            self.smooth_plus = self.smooth_plus - (self.smooth_plus / self.n) + DM_plus
+            self.smooth_minus = self.smooth_minus - (self.smooth_minus / self.n) + DM_minus
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            indicator_plus = (np.float64(self.smooth_plus) / self.true_range) * 100
+            indicator_minus = (np.float64(self.smooth_minus) / self.true_range) * 100
+            dx = (abs((indicator_plus - indicator_minus) / (indicator_plus + indicator_minus))) * 100
+
+        self.DI_plus, self.DI_minus = indicator_plus, indicator_minus
+
+        return (1 / self.n) * self.dx.push(dx)
+
+
+# On-Balance Volume
+class OBVStream(StreamingState):
+
+    def __init__(self):
+        self.prev = None
+        self.obv = 0
+
+    def update(self, bar):
+        close = bar['Adj Close']
+
+        if self.prev is not None:
+            if close > self.prev:
+                self.obv = self.obv + bar['Volume']
+            elif close < self.prev:
+                self.obv = self.obv - bar['Volume']
+
+        self.prev = close
+
+        return self.obv
+
+
+# every indicator of indicators(), fed one bar at a time
+class IndicatorStream(StreamingState):
+
+    def __init__(self, rsi = 9, so = 14, ma_so = 5, ma = 20, sd_boll = 2, macd_small = 12, macd_large = 26, adx_length = 14,
+                 so_high_low = False):
+        self.warmup = indicator_warmup({'rsi': rsi, 'so': so, 'ma_so': ma_so, 'ma': ma, 'macd_small': macd_small,
+                                        'macd_large': macd_large}) # first row of indicators() with the same parameters
+        self.count = 0
+        self.RSI = RSIStream(rsi)
+        self.oscill = OscillStream(so, ma_so, so_high_low)
+        self.boll = BollStream(sd_boll, ma)
+        self.MACD = MACDStream(macd_large, macd_small)
+        self.ADX = ADXStream(adx_length)
+        self.OBV = OBVStream()
+
+    # bar: mapping with 'High', 'Low', 'Adj Close' and 'Volume' (e.g. a row of the yahoo dataframe)
+    def update(self, bar):
+        RSI = self.RSI.update(bar)
+        K, D = self.oscill.update(bar)
+        MA, boll_up, boll_dw = self.boll.update(bar)
+        macd_short, macd_long = self.MACD.update(bar)
+        adx = self.ADX.update(bar)
+        obv = self.OBV.update(bar)
+        self.count += 1
+
+        return {'RSI': RSI, 'D': D, 'MA': MA, 'boll_up': boll_up,
+                'boll_dw': boll_dw, 'MACD_short' : macd_short, 'MACD_long' : macd_long,
+                'adx' : adx, 'OBV' : obv, 'DI_plus' : self.ADX.DI_plus, 'DI_minus' : self.ADX.DI_minus}
+
+    # True once the row has the same warm-up as the first row of indicators()
+    def ready(self):
+        return self.count > self.warmup
+
+
+# replays a price history through an IndicatorStream, returns the stream and the rows aligned like indicators()
+@traced
+def stream_indicators(data, stream = None):
+    if stream is None:
+        stream = IndicatorStream()
+
+    rows = []
+
+    for bar in data[['High', 'Low', 'Adj Close', 'Volume']].to_dict('records'):
+        row = stream.update(bar)
+        if stream.ready():
+            rows.append(row)
+
+    return stream, pd.DataFrame(rows, columns = ['RSI', 'D', 'MA', 'boll_up', 'boll_dw', 'MACD_short', 'MACD_long', 'adx', 'OBV'])
 # encodes data into buy/hold/sell and add indicators
+@traced
 def encode(data):
     list = []
 
@@ -294,6 +1202,7 @@ def encode(data):
 
     return data;
 # transform the indicators from raw value to signal
+@traced
 def transform(data):
     RSI_signal = [4]
     D_signal = [4]
@@ -337,33 +1246,30 @@ def transform(data):
         else:
             MACD_signal.append(2)
 
-    for p in range(0, len(data)):
-        if data['position'][p] == 2:
-            data['position'][p] = 1
-        elif data['position'][p] == 3:
-            data['position'][p] = 0
+    position = data['position'].to_numpy()
+    data['position'] = np.where(position == 2, 1, np.where(position == 3, 0, position)) # hold counts as buy, sell as 0
 
     data['RSI'] = RSI_signal
     data['D'] = D_signal
     data['boll'] = boll_signal
     data['MACD'] = MACD_signal
 
-    encoder = OneHotEncoder()
+    encoder = preprocessing.OneHotEncoder()
 
     RSI_cat = encoder.fit_transform(data[['RSI']]).toarray()
-    RSI_name = encoder.get_feature_names(['RSI'])
+    RSI_name = encoder.get_feature_names_out(['RSI'])
     RSI_cat = pd.DataFrame(RSI_cat, columns=RSI_name)
 
     D_cat = encoder.fit_transform(data[['D']]).toarray()
-    D_name = encoder.get_feature_names(['D'])
+    D_name = encoder.get_feature_names_out(['D'])
     D_cat = pd.DataFrame(D_cat, columns=D_name)
 
     boll_cat = encoder.fit_transform(data[['boll']]).toarray()
-    boll_name = encoder.get_feature_names(['boll'])
+    boll_name = encoder.get_feature_names_out(['boll'])
     boll_cat = pd.DataFrame(boll_cat, columns=boll_name)
 
     MACD_cat = encoder.fit_transform(data[['MACD']]).toarray()
-    MACD_name = encoder.get_feature_names(['MACD'])
+    MACD_name = encoder.get_feature_names_out(['MACD'])
     MACD_cat = pd.DataFrame(MACD_cat, columns=MACD_name)
 
     data = data.join(RSI_cat)
@@ -374,7 +1280,136 @@ def transform(data):
     data.drop(['MACD_short', 'MA', 'boll_up', 'boll_dw', 'boll', 'MACD_long', 'RSI', 'D', 'MACD', 'RSI_4', 'D_4', 'boll_2'], axis = 1, inplace = True)
 
     return data;
+# Signal rules of transform, as data: every rule compares operands (an indicator, 'price', 'next' or a number) and gives
+# each bar the code of the first case whose comparisons hold, its default otherwise; 'first': code of the first bar
+# (transform has no bar before it), a case is (code, conditions), a condition (comparison, sign on the bar before,
+# sign on the bar) where a sign is 1 above, -1 below, 0 equal or nan, None any
+# 'dropped': code without a one-hot column (transform drops RSI_4, D_4 and boll_2)
+def level_crossings(column, high, low): # 0 up through high, 1 down through high, 2 up through low, 3 down through low, 4 none
+    return {'compare': [(column, high), (column, low)], 'default': 4, 'first': 4, 'dropped': 4,
+            'cases': [(0, [(0, -1, 1)]), (1, [(0, 1, -1)]), (2, [(1, -1, 1)]), (3, [(1, 1, -1)])]}
+SIGNAL_RULES = {
+    'RSI': level_crossings('RSI', 70, 30),
+    'D': level_crossings('D', 80, 20),
+    'boll': {'compare': [('price', 'boll_up'), ('price', 'boll_dw')], 'default': 2, 'first': 2, 'dropped': 2, # band breaks
+             'cases': [(0, [(0, None, 1)]), (1, [(1, None, -1)])]},
+    'MACD': {'compare': [('MACD_short', 'MACD_long')], 'default': 2, 'first': 2, 'dropped': None, # 0 short crosses above long, 1 below
+             'cases': [(0, [(0, -1, 1)]), (1, [(0, 1, -1)])]},
+}
+# label of encode + transform: 1 when the next close is up or flat, 0 when it is down
+LABEL_RULE = {'compare': [('next', 'price')], 'default': 0, 'dropped': None, 'cases': [(1, [(0, None, 1)]), (1, [(0, None, 0)])]}
+# lookup table of a rule: code of every combination of signs, indexed by the sum over comparisons i of
+# 9 ** i * (3 * (sign before + 1) + sign + 1), built once per call (3 ** (2 * comparisons) cells)
+def signal_table(rule):
+    comparisons = len(rule['compare'])
+    table = np.full(9 ** comparisons, rule['default'], dtype = np.uint8)
+
+    for index, signs in enumerate(itertools.product([-1, 0, 1], repeat = 2 * comparisons)):
+        before_now = {i: (signs[2 * (comparisons - 1 - i)], signs[2 * (comparisons - 1 - i) + 1]) for i in range(comparisons)}
+        for code, conditions in rule['cases']:
+            if all(before in (None, before_now[i][0]) and now in (None, before_now[i][1]) for i, before, now in conditions):
+                table[index] = code
+                break
+
+    return table
+# codes of a rule on every bar: one pass of comparisons per operand pair, a shifted copy and a table lookup
+# operands: name -> array of the bars (numbers in the rule are broadcast)
+def signal_codes(rule, operands):
+    index = None
+
+    for i, (a, b) in enumerate(rule['compare']):
+        a = operands[a] if isinstance(a, str) else a
+        b = operands[b] if isinstance(b, str) else b
+        sign = np.greater(a, b).view(np.int8) - np.less(a, b).view(np.int8) + 1 # 0 below, 1 equal or nan, 2 above
+        before = np.empty_like(sign)
+        before[0] = 1
+        before[1:] = sign[:-1]
+
+        digit = (3 * before + sign).astype(np.uint16) * np.uint16(9 ** i) # up to 5 comparisons
+        index = digit if index is None else index + digit
+
+    code = signal_table(rule)[index]
+    if 'first' in rule:
+        code[0] = rule['first']
+
+    return code
+# encode + transform fused: from the raw OHLCV frame to the model matrix without intermediate dataframes
+# same output as transform(encode(data)): Adj Close, position, adx, OBV and the one-hot signals kept by transform
+# compact: uint8 signals, float32 adx/OBV and int8 labels instead of float64/int64 (Adj Close stays float64 for the backtests)
+# extra: raw indicators added after OBV (e.g. ['DI_plus', 'DI_minus'])
+@traced
+def features(data, compact = False, params = None, extra = ()):
+    arrays, warmup = indicator_arrays(data, params)
+    close = data['Adj Close'].to_numpy(dtype = float)
+
+    # encode pairs the close and position of bar p with the indicators of bar p + 1
+    rows = slice(warmup - 1, len(close) - 1)
+    ind = {name : values[warmup:] for name, values in arrays.items()}
+    price = close[rows]
+
+    operands = dict(ind, price = price, next = close[warmup : len(close)])
+    position = signal_codes(LABEL_RULE, operands).astype(np.int64) # up or flat -> 1, down -> 0
+
+    # one-hot columns of the codes of each rule that occur, minus the dropped code
+    columns = []
+    for name, rule in SIGNAL_RULES.items():
+        codes = signal_codes(rule, operands)
+        occurs = np.bincount(codes, minlength = 256) > 0
+        for code in np.flatnonzero(occurs):
+            if code != rule['dropped']:
+                columns.append((name + '_' + str(code), codes, code))
+
+    onehot = np.zeros((len(price), len(columns)), dtype = np.uint8 if compact else np.float64) # single allocation for every signal column
+    for j, (col, codes, code) in enumerate(columns):
+        np.equal(codes, code, out = onehot[:, j], casting = 'unsafe')
+
+    if compact:
+        df = {'Adj Close' : price, 'position' : position.astype(np.int8),
+              'adx' : ind['adx'].astype(np.float32), 'OBV' : ind['OBV'].astype(np.float32)}
+    else:
+        df = {'Adj Close' : price, 'position' : position, 'adx' : ind['adx'], 'OBV' : ind['OBV']}
+    df.update({col : ind[col].astype(np.float32) if compact else ind[col] for col in extra})
+    df.update({col : onehot[:, j] for j, (col, codes, code) in enumerate(columns)})
+
+    return pd.DataFrame(df)
+# dtype each model computes in: libsvm and statsmodels work in float64, keras and MinMaxScaler keep float32
+MODEL_DTYPES = {'logit': np.float64, 'svm': np.float64, 'keras': np.float32, 'scaler': np.float32}
+# converts a feature matrix once, explicitly, to the dtype of the model it is fed to (no copy when it already matches)
+def model_input(X, model):
+    dtype = MODEL_DTYPES[model]
+
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.astype(dtype, copy = False)
+
+    return np.asarray(X, dtype = dtype)
+# runs func(*args) and returns its result with the peak memory allocated during the call (MB, python and numpy)
+def peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, peak / 2 ** 20
+# checks features() against transform(encode()) and prints the peak memory of both paths
+def features_parity(data):
+    staged_path = lambda data: transform(encode(data.copy()))
+
+    # one run of each first, so the lazy imports (scipy.signal, sklearn) are not counted in the peaks
+    features(data)
+    staged_path(data)
+
+    fused, fused_peak = peak_memory(features, data)
+    staged, staged_peak = peak_memory(staged_path, data)
+
+    pd.testing.assert_frame_equal(fused, staged, check_dtype = False, rtol = 1e-9)
+
+    print('peak memory fused : ', round(fused_peak, 2), 'MB  encode + transform : ', round(staged_peak, 2), 'MB')
+
+    return fused_peak, staged_peak
 # Splits data into training and testing
+@traced
 def test_train_split(data, train):
 
     slice = train * len(data)
@@ -398,6 +1433,7 @@ def test_train_split(data, train):
     X_test.reset_index(drop=True, inplace=True)
 
     return data, data_test, X, y, X_test, y_test;
+@traced
 def test_train_SP(data, train):
     data = data[data.index[26]: data.index[len(data) - 1]]
 
@@ -413,46 +1449,647 @@ def test_train_SP(data, train):
     data_test.reset_index(drop = True, inplace = True)
 
     return data, data_test;
-# plots of conditional distributions with respect to inputs
-def inputPlots(data):
-    fig, axs = plt.subplots(2, 3)
-
-    axs[0, 0].scatter(y = data['RSI'], x = data['position'])
-    axs[0, 0].set_title('Relative Strenght Index')
-    axs[0, 0].set_xlabel('position')
-    axs[0, 0].set_ylabel('RSI')
-
-    axs[0, 1].scatter(y=data['MA'], x=data['position'])
-    axs[0, 1].set_title('20 days moving average')
-    axs[0, 1].set_xlabel('position')
-    axs[0, 1].set_ylabel('moving average')
-
-    axs[0, 2].scatter(y = data['D'], x = data['position'])
-    axs[0, 2].set_title('smoothed stochastic oscillator')
-    axs[0, 2].set_xlabel('position')
-    axs[0, 2].set_ylabel('oscillator')
-
-    axs[1, 0].scatter(y = data['adx'], x = data['position'])
-    axs[1, 0].set_title('Average Directional Index')
-    axs[1, 0].set_xlabel('position')
-    axs[1, 0].set_ylabel('ADX')
-
-    axs[1, 1].scatter(y = data['OBV'], x = data['position'])
-    axs[1, 1].set_title('On-Balance Volume')
-    axs[1, 1].set_xlabel('position')
-    axs[1, 1].set_ylabel('OBV')
-
-    axs[1, 2].scatter(y = data['boll_up'], x = data['position'])
-    axs[1, 2].set_title('Upper Bollinger Band')
-    axs[1, 2].set_xlabel('position')
-    axs[1, 2].set_ylabel('Bollinger Band')
+# Data sources: callables (ticker, start, end) -> dataframe of daily bars indexed by Date
+PRICE_COLUMNS = ['High', 'Low', 'Open', 'Close', 'Volume', 'Adj Close']
+# yahoo API through pandas_datareader
+class YahooSource:
+
+    @traced
+    def __call__(self, ticker, start, end):
+        return web.DataReader(ticker, 'yahoo', start, end)[PRICE_COLUMNS]
+# local csv files named <ticker>.csv in a directory (yahoo export layout: Date, Open, High, Low, Close, Adj Close, Volume)
+class CSVSource:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @traced
+    def __call__(self, ticker, start, end):
+        data = pd.read_csv(os.path.join(self.directory, ticker + '.csv'), index_col = 'Date', parse_dates = True)
+        data.sort_index(inplace = True)
+
+        return data.loc[start : end, PRICE_COLUMNS]
+# on-disk cache in front of another source
+# each ticker is stored as memory-mappable .npy files (dates + float64 price matrix) plus the covered date range, in a
+# version folder named by current.json; only the missing dates before/after the covered range are fetched, cached loads
+# are memory maps (no parsing), and the bars of today (which may still change) are fetched on every call but never stored
+class CachedSource:
+
+    def __init__(self, source, directory):
+        self.source = source
+        self.directory = directory
+
+    def path(self, ticker):
+        return os.path.join(self.directory, quote(ticker, safe = ''))
+
+    # folder of the current version of a ticker (dates.npy, prices.npy and range.json), None when it is not cached
+    def folder(self, ticker):
+        try:
+            with open(os.path.join(self.path(ticker), 'current.json')) as f:
+                return os.path.join(self.path(ticker), json.load(f)['version'])
+        except FileNotFoundError:
+            return None
+
+    # func(folder) on the current version, again on the new one when a writer replaced it meanwhile
+    def current(self, ticker, func):
+        while True:
+            folder = self.folder(ticker)
+            if folder is None:
+                raise FileNotFoundError(os.path.join(self.path(ticker), 'current.json'))
+            try:
+                return func(folder)
+            except FileNotFoundError:
+                if self.folder(ticker) == folder:
+                    raise
+
+    def covered(self, ticker):
+        def covered(folder):
+            with open(os.path.join(folder, 'range.json')) as f:
+                meta = json.load(f)
+            return pd.Timestamp(meta['start']), pd.Timestamp(meta['end'])
+
+        return None if self.folder(ticker) is None else self.current(ticker, covered)
+
+    def read(self, ticker):
+        def read(folder):
+            dates = np.load(os.path.join(folder, 'dates.npy'), mmap_mode = 'r')
+            prices = np.load(os.path.join(folder, 'prices.npy'), mmap_mode = 'c') # copy-on-write, the file is never modified
+            return dates, prices
+
+        return self.current(ticker, read)
+
+    def write(self, ticker, data, start, end):
+        os.makedirs(self.path(ticker), exist_ok = True)
+
+        # the three files go to a new version folder, then current.json is swapped to it in one rename: a reader sees
+        # either version whole, and the maps opened on the old one stay valid after it is removed
+        version = tempfile.mkdtemp(prefix = 'v', dir = self.path(ticker))
+        np.save(os.path.join(version, 'dates.npy'), data.index.values.astype('datetime64[ns]'))
+        np.save(os.path.join(version, 'prices.npy'), np.ascontiguousarray(data[PRICE_COLUMNS].to_numpy(dtype = float)))
+        with open(os.path.join(version, 'range.json'), 'w') as f:
+            json.dump({'start': start.isoformat(), 'end': end.isoformat()}, f)
+
+        previous = self.folder(ticker)
+        tmp = os.path.join(self.path(ticker), 'current.json.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': os.path.basename(version)}, f)
+        os.replace(tmp, os.path.join(self.path(ticker), 'current.json'))
+
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors = True)
+        for name in ['dates.npy', 'prices.npy', 'range.json']: # files of the unversioned layout
+            if os.path.exists(os.path.join(self.path(ticker), name)):
+                os.remove(os.path.join(self.path(ticker), name))
+
+    def fetch(self, ticker, start, end):
+        data = self.source(ticker, start, end)
+        data.index = pd.DatetimeIndex(data.index).tz_localize(None)
+
+        return data[PRICE_COLUMNS]
+
+    @traced
+    def __call__(self, ticker, start, end):
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        today = pd.Timestamp.today().normalize()
+        stored_end = min(end, today - pd.Timedelta(days = 1)) # today's bar may still change
+        covered = self.covered(ticker)
+
+        if start > stored_end: # only bars of today, nothing to cache
+            return self.fetch(ticker, start, end)
+
+        if covered is None or start < covered[0] or stored_end > covered[1]:
+            if covered is None:
+                data = self.fetch(ticker, start, stored_end)
+                new_start, new_end = start, stored_end
+            else:
+                dates, prices = self.read(ticker)
+                parts = [pd.DataFrame(np.array(prices), index = pd.DatetimeIndex(dates), columns = PRICE_COLUMNS)]
+
+                if start < covered[0]:
+                    parts.insert(0, self.fetch(ticker, start, covered[0] - pd.Timedelta(days = 1)))
+                if stored_end > covered[1]:
+                    parts.append(self.fetch(ticker, covered[1] + pd.Timedelta(days = 1), stored_end))
+
+                data = pd.concat(parts, axis = 0)
+                new_start, new_end = min(start, covered[0]), max(stored_end, covered[1])
+
+            data = data[~data.index.duplicated(keep = 'last')].sort_index()
+            self.write(ticker, data[data.index < today], new_start, new_end)
+
+        dates, prices = self.read(ticker)
+        first, last = np.searchsorted(dates, np.datetime64(start, 'ns'), 'left'), np.searchsorted(dates, np.datetime64(end, 'ns'), 'right')
+
+        # a single float64 block over the memory map, the dataframe does not copy it
+        data = pd.DataFrame(prices[first : last], index = pd.DatetimeIndex(dates[first : last], name = 'Date'), columns = PRICE_COLUMNS, copy = False)
+
+        if end >= today: # today's bars, fetched on their own without rewriting the history
+            recent = self.fetch(ticker, today, end)
+            recent = recent[recent.index >= today]
+            if len(recent) > 0:
+                data = pd.concat([data, recent], axis = 0)
+                data.index.name = 'Date'
+
+        return data
+# content-addressed on-disk store of features() frames (encode + transform), bounded to max_bytes by evicting the least recently used
+# the key hashes the prices, the date range, the indicator parameters and the layout, so iterating on the models skips the
+# feature stage, and new data or parameters are new entries while the old ones age out
+class FeatureStore:
+
+    version = 2 # part of every key, bumped whenever features() changes its output
+
+    def __init__(self, directory, max_bytes = 2 ** 31):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, compact = False, params = None, extra = ()):
+        meta = {'version': self.version, 'compact': compact, 'params': indicator_params(params), 'extra': list(extra), 'bars': len(data),
+                'rules': [SIGNAL_RULES, LABEL_RULE],
+                'start': str(data.index[0]) if len(data) > 0 else None, 'end': str(data.index[-1]) if len(data) > 0 else None,
+                'volume': str(data['Volume'].dtype)}
+
+        digest = hashlib.sha1(json.dumps(meta, sort_keys = True).encode())
+        digest.update(np.ascontiguousarray(data.index.values).tobytes())
+        for col in ['High', 'Low', 'Adj Close', 'Volume']: # the columns features() reads
+            digest.update(np.ascontiguousarray(data[col].to_numpy(dtype = float)).tobytes())
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                frame = pickle.load(f)
+            os.utime(self.path(key)) # the modification time orders the entries by last use
+        except FileNotFoundError:
+            return None
+
+        return frame
+
+    def put(self, key, frame):
+        os.makedirs(self.directory, exist_ok = True)
+
+        # written under a temporary name then renamed, so concurrent processes never read half a file
+        tmp = self.path(key) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(frame, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path(key))
+
+        self.evict(keep = key)
+
+    # removes the least recently used entries until the store fits in max_bytes (keep: entry never removed)
+    def evict(self, keep = None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl') and name != str(keep) + '.pkl':
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError: # evicted by another process
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.directory, name)))
+
+        total = sum(size for mtime, size, path in entries)
+        if keep is not None and os.path.exists(self.path(keep)):
+            total += os.path.getsize(self.path(keep))
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # features(data, compact, params, extra), read from the store when these prices were already transformed
+    @traced
+    def __call__(self, data, compact = False, params = None, extra = ()):
+        key = self.key(data, compact, params, extra)
+        frame = self.get(key)
+
+        if frame is None:
+            self.misses += 1
+            frame = features(data, compact, params, extra)
+            self.put(key, frame)
+        else:
+            self.hits += 1
+
+        return frame
+# feature pipeline for one symbol: load -> features (encode + transform) -> train/test split, keeps the dates
+# store: FeatureStore the features are read from / written to (None = always computed)
+def symbol_pipeline(ticker, start, end, train, loader, compact = False, params = None, store = None):
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    bars = 0
+
+    try:
+        data = loader(ticker, start, end)
+        dates = data.index
+        bars = len(data)
+
+        data = features(data, compact, params) if store is None else store(data, compact, params)
+        data.insert(0, 'Date', dates[len(dates) - 1 - len(data) : len(dates) - 1]) # the warm-up and the last bar are dropped
+
+        data, data_test, X, y, X_test, y_test = test_train_split(data, train)
+        data.insert(1, 'split', 'train')
+        data_test.insert(1, 'split', 'test')
+
+        frame = pd.concat([data, data_test], axis = 0, ignore_index = True)
+        frame.insert(0, 'ticker', ticker)
+        error = None
+    except Exception as e: # one bad symbol must not stop the panel
+        frame = None
+        error = repr(e)
+
+    timing = {'ticker': ticker, 'bars': bars, 'rows': 0 if frame is None else len(frame),
+              'seconds': time.perf_counter() - t0, 'cpu_seconds': time.process_time() - cpu0, 'error': error}
+
+    return frame, timing
+def _symbol_pipeline(args):
+    return symbol_pipeline(*args)
+# runs the feature pipeline over a list of tickers in a process pool
+# returns one long frame indexed by (ticker, Date) and a per-symbol timing table
+# workers: number of processes (None = all cores, 1 = serial in this process)
+# loader: any data source (YahooSource, CSVSource, CachedSource)
+# tasks_per_worker: worker processes are recycled after that many symbols to keep memory bounded
+# compact: compact model matrix (see features), params: indicator parameters (see INDICATOR_PARAMS)
+# store: FeatureStore shared by the workers (None = features always computed)
+@traced
+def panel(tickers, start, end, train = 0.7, workers = None, loader = YahooSource(), tasks_per_worker = 50, compact = False,
+          params = None, store = None):
+    jobs = [(ticker, start, end, train, loader, compact, params, store) for ticker in tickers]
+    frames = []
+    timings = []
+    t0 = time.perf_counter()
+
+    if workers == 1:
+        results = map(_symbol_pipeline, jobs)
+        pool = None
+    else:
+        pool = Pool(processes = workers, maxtasksperchild = tasks_per_worker)
+        results = pool.imap_unordered(_symbol_pipeline, jobs, chunksize = 1)
+
+    try:
+        for frame, timing in results:
+            if frame is not None:
+                frames.append(frame)
+            timings.append(timing)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    timings = pd.DataFrame(timings, columns = ['ticker', 'bars', 'rows', 'seconds', 'cpu_seconds', 'error'])
+    timings = timings.sort_values('seconds', ascending = False, ignore_index = True)
+
+    print('symbols : ', len(tickers), ' failed : ', timings['error'].notna().sum())
+    print('wall time : ', round(time.perf_counter() - t0, 2), 's  symbol time : ', round(timings['seconds'].sum(), 2), 's')
+
+    if len(frames) == 0:
+        return pd.DataFrame(), timings
+
+    data = pd.concat(frames, axis = 0, ignore_index = True)
+
+    # a signal that never fired for a symbol has no one-hot column there
+    signals = [col for col in data.columns if col.split('_')[0] in SIGNAL_RULES]
+    data[signals] = data[signals].fillna(0).astype(np.uint8 if compact else np.float64)
+
+    data.set_index(['ticker', 'Date'], inplace = True)
+    data.sort_index(inplace = True)
+
+    return data, timings
+# Walk-forward evaluation
+# (train, test) slices of a series of n rows: the training window is expanding (from row 0) or sliding (fixed length),
+# the test window of `test` rows follows it and the origin moves by `step` rows (default: test)
+def walk_forward_folds(n, train, test, step = None, mode = 'expanding'):
+    if mode not in ['expanding', 'sliding']:
+        raise ValueError("mode must be 'expanding' or 'sliding'")
+
+    step = test if step is None else step
+    folds = []
+    origin = train
+
+    while origin + test <= n:
+        folds.append((slice(0 if mode == 'expanding' else origin - train, origin), slice(origin, origin + test)))
+        origin += step
+
+    return folds
+# features and labels shared with the fold workers, set once per worker process
+_walk_forward_data = None
+def _walk_forward_worker(data):
+    global _walk_forward_data
+
+    _walk_forward_data = data
+# fits one fold: scaler fitted on the training window only, predictions on the test window
+# fitted scaler and model are pickled under cache_dir, so a fold that was already trained is only reloaded
+def walk_forward_fold(args):
+    fold, train, test, model, key, cache_dir = args
+    X, y = _walk_forward_data
+    t0 = time.perf_counter()
+    path = None if cache_dir is None else os.path.join(cache_dir, key + '.pkl')
+
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as f:
+            scaler, fitted = pickle.load(f)
+        cached = True
+    else:
+        scaler = preprocessing.MinMaxScaler(feature_range = [0, 1]).fit(X[train]) # slices of the shared matrix are views
+        fitted = sklearn_base.clone(model).fit(scaler.transform(X[train]), y[train])
+        cached = False
+
+        if path is not None:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump((scaler, fitted), f)
+            os.replace(path + '.tmp', path)
+
+    pred = fitted.predict(scaler.transform(X[test]))
+
+    result = {'fold': fold, 'train_start': train.start, 'train_end': train.stop, 'test_start': test.start, 'test_end': test.stop,
+              'accuracy': np.mean(pred == y[test]),
+              'auc': metrics.roc_auc_score(y[test], pred) if len(np.unique(y[test])) == 2 else np.nan,
+              'seconds': time.perf_counter() - t0, 'cached': cached}
+
+    return result, pred
+# walk-forward evaluation of a sklearn-style model over the transformed data (output of transform())
+# folds: output of walk_forward_folds, workers: number of processes (1 = serial), cache_dir: per-fold model cache
+# returns the per-fold results and the out-of-sample predictions (row index of data, fold, pred)
+@traced
+def walk_forward(data, model, folds, workers = None, cache_dir = None):
+    X = data.drop(['Adj Close', 'position'], axis = 1).to_numpy(dtype = float) # built once, every fold reads views of it
+    y = data['position'].to_numpy()
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok = True)
+
+    # cache keys depend on the data, the model and the fold bounds, so new folds never invalidate old ones
+    digest = hashlib.sha1(X.tobytes())
+    digest.update(y.tobytes())
+    digest.update(repr(model).encode())
+    fingerprint = digest.hexdigest()
+
+    jobs = []
+    for fold, (train, test) in enumerate(folds):
+        key = hashlib.sha1((fingerprint + repr((train.start, train.stop, test.start, test.stop))).encode()).hexdigest()
+        jobs.append((fold, train, test, model, key, cache_dir))
+
+    if workers == 1:
+        _walk_forward_worker((X, y))
+        outputs = list(map(walk_forward_fold, jobs))
+    else:
+        # the matrix goes through the initializer: inherited by forked workers, pickled once per spawned one
+        with Pool(processes = workers, initializer = _walk_forward_worker, initargs = ((X, y),)) as pool:
+            outputs = pool.map(walk_forward_fold, jobs, chunksize = 1)
+
+    results = pd.DataFrame([result for result, pred in outputs])
+    predictions = pd.DataFrame({'row': np.concatenate([np.arange(test.start, test.stop) for train, test in folds]),
+                                'fold': np.concatenate([np.full(test.stop - test.start, fold) for fold, (train, test) in enumerate(folds)]),
+                                'pred': np.concatenate([pred for result, pred in outputs])})
+
+    print('folds : ', len(folds), ' trained : ', (~results['cached']).sum(), ' mean accuracy : ', round(results['accuracy'].mean(), 4))
+
+    return results, predictions
+# RBF SVM hyperparameter search
+# RBF SVM fitted on a precomputed matrix of squared distances, exp(-gamma * D2) is built at fit time:
+# every (C, gamma) cell of a search slices the same distance matrix instead of recomputing kernel rows
+# (the class is defined on first use, so sklearn is only imported when a search runs)
+_DistanceRBFSVC = None
+def distance_rbf_svc():
+    global _DistanceRBFSVC
+
+    if _DistanceRBFSVC is None:
+        class DistanceRBFSVC(sklearn_base.ClassifierMixin, sklearn_base.BaseEstimator):
+
+            def __init__(self, C = 1.0, gamma = 1.0, max_iter = 1000):
+                self.C = C
+                self.gamma = gamma
+                self.max_iter = max_iter
+
+            def fit(self, D2, y):
+                self.svc_ = svm.SVC(C = self.C, kernel = 'precomputed', max_iter = self.max_iter).fit(np.exp(-self.gamma * D2), y)
+                self.classes_ = self.svc_.classes_
+                return self
+
+            def predict(self, D2):
+                return self.svc_.predict(np.exp(-self.gamma * D2))
+
+            # cross-validation slices rows and columns of D2: __sklearn_tags__ from sklearn 1.6, _more_tags before
+            def __sklearn_tags__(self):
+                tags = super().__sklearn_tags__()
+                tags.input_tags.pairwise = True
+                return tags
+
+            def _more_tags(self):
+                return {'pairwise': True}
+
+        DistanceRBFSVC.__qualname__ = 'DistanceRBFSVC' # pickled by reference as PyProject.DistanceRBFSVC (see __getattr__)
+        _DistanceRBFSVC = DistanceRBFSVC
+
+    return _DistanceRBFSVC
+# module attributes defined on first use (pickle looks DistanceRBFSVC up here in the search workers)
+def __getattr__(name):
+    if name == 'DistanceRBFSVC':
+        return distance_rbf_svc()
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+# (C, gamma) search with time-series splits, run in parallel (workers = n_jobs, -1 for all cores)
+# halving: successive halving prunes the weakest cells on small training samples before fitting the survivors on all of it
+# returns the search and an rbf SVC refitted on X with the best parameters
+@traced
+def rbf_search(X, y, C, gamma, n_splits = 5, workers = -1, halving = True, max_iter = 1000):
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y)
+    t0 = time.perf_counter()
+
+    D2 = metrics.pairwise.euclidean_distances(X, squared = True) # computed once for the whole grid
+    grid = {'C': C, 'gamma': gamma}
+    cv = model_selection.TimeSeriesSplit(n_splits = n_splits)
+
+    if halving:
+        importlib.import_module('sklearn.experimental.enable_halving_search_cv')
+        search = model_selection.HalvingGridSearchCV(distance_rbf_svc()(max_iter = max_iter), grid, cv = cv, factor = 3, min_resources = 'exhaust',
+                                     n_jobs = workers, refit = False, random_state = 0)
+    else:
+        search = model_selection.GridSearchCV(distance_rbf_svc()(max_iter = max_iter), grid, cv = cv, n_jobs = workers, refit = False)
+
+    search.fit(D2, y)
+
+    best = svm.SVC(kernel = 'rbf', max_iter = max_iter, **search.best_params_).fit(X, y)
+
+    print('cells fitted : ', len(search.cv_results_['params']), ' search time : ', round(time.perf_counter() - t0, 2), 's')
+
+    return search, best
+# Figures: every plot is a template (figure and artists built once) whose data is swapped for each figure drawn
+# interactive by default (plt.show()); with enable_report(directory) or --report the figures are queued instead
+# and render_report() writes them all as png files from worker processes on the Agg backend
+_report = None # directory and queued figures of the headless report
+_figure_templates = {} # (kind, dated axes) -> (figure, axes, artists), kept by each render process
+# kind: (figsize, rows, columns, template of each axes)
+FIGURE_KINDS = {
+    'line': ((6.4, 4.8), 1, 1, ['line']),
+    'bars': ((6.4, 4.8), 1, 1, ['bars']),
+    'roc': ((6.4, 4.8), 1, 1, ['roc']),
+    'results': ((10, 5), 1, 2, ['roc', 'line']),
+    'inputs': ((10, 6), 2, 3, ['scatter'] * 6),
+}
+def enable_report(directory):
+    global _report
+
+    _report = {'directory': directory, 'jobs': [], 'names': {}} # names: figures drawn under each name, keeps file names unique
+# artists of one axes, drawn without data
+def _axes_template(ax, kind):
+    if kind == 'roc':
+        curve, = ax.plot([], [], lw=2, alpha=0.7)
+        ax.plot([0, 1], [0, 1], linestyle='--', lw=2, color='r', alpha=.8)
+        ax.set_xlabel('False Positive Rate')
+        ax.set_ylabel('True Positive Rate')
+        return [curve]
+    if kind == 'scatter':
+        return [ax.scatter([], [])]
+    return [] # lines and bars: one per series, added on first use
+# x and y limits of the axes set from the data (autoscaling ignores scatter offsets)
+def _axes_limits(ax, x, y):
+    for values, set_limits in ((x, ax.set_xlim), (y, ax.set_ylim)):
+        if len(values) > 0:
+            low, high = np.nanmin(values), np.nanmax(values)
+            margin = 0.05 * (high - low) if high > low else 0.5
+            set_limits(low - margin, high + margin)
+# line axes whose x values are dates: their template keeps a date axis (xaxis_date() cannot be undone)
+def _axes_dated(kind, spec):
+    return kind == 'line' and spec.get('x') is not None and np.issubdtype(np.asarray(spec['x']).dtype, np.datetime64)
+# swaps the data of the artists of one axes, spec: dict of the arrays and labels of the axes
+# every label is set again (empty when the spec has none) so a template keeps nothing of the figure drawn before
+def _axes_update(ax, kind, artists, spec):
+    xlabel, ylabel = ('False Positive Rate', 'True Positive Rate') if kind == 'roc' else ('', '')
+    ax.set_title(spec.get('title', ''))
+    ax.set_xlabel(spec.get('xlabel', xlabel))
+    ax.set_ylabel(spec.get('ylabel', ylabel))
+
+    if kind == 'roc':
+        artists[0].set_data(spec['fpr'], spec['tpr'])
+        artists[0].set_label(spec['label'])
+        _axes_limits(ax, [0, 1], [0, 1])
+        ax.legend(loc = 'lower right')
+
+    elif kind == 'scatter':
+        x, y = np.asarray(spec.get('x', []), dtype = float), np.asarray(spec.get('y', []), dtype = float)
+        artists[0].set_offsets(np.column_stack([x, y]))
+        _axes_limits(ax, x, y)
+
+    elif kind == 'line':
+        ys = spec.get('y', [])
+        x = spec.get('x', None)
+        if _axes_dated(kind, spec):
+            x = mdates.date2num(np.asarray(x))
+            ax.xaxis_date()
+
+        while len(artists) < len(ys):
+            artists.append(ax.plot([], [])[0])
+        for line in artists[len(ys):]:
+            line.set_data([], [])
+
+        for line, values in zip(artists, ys):
+            line.set_data(np.arange(len(values)) if x is None else x, values)
+        ax.relim()
+        ax.autoscale_view()
+
+    elif kind == 'bars':
+        heights = spec.get('heights', [])
+        for bars in artists:
+            bars.remove()
+        artists[:] = [ax.bar(spec['x'], height, color = 'C' + str(i), alpha = 0.7) for i, height in enumerate(heights)]
+        _axes_limits(ax, [], [0] + [max(h) for h in heights if len(h) > 0])
+# draws one figure: shown at once, or queued for render_report() when the headless report is on
+# specs: one dict per axes of the kind (see _axes_update)
+def show_figure(kind, name, specs):
+    if _report is not None:
+        count = _report['names'].get(name, 0) + 1
+        _report['names'][name] = count
+        _report['jobs'].append((kind, name if count == 1 else name + '_' + str(count), specs))
+        return
+
+    figsize, rows, columns, axes_kinds = FIGURE_KINDS[kind]
+    fig, axs = plt.subplots(rows, columns, figsize = figsize, squeeze = False)
+
+    for ax, axes_kind, spec in zip(axs.flat, axes_kinds, specs):
+        _axes_update(ax, axes_kind, _axes_template(ax, axes_kind), spec)
 
     fig.subplots_adjust(hspace=0.5, wspace=0.5)
-
     plt.show()
+# renders one queued figure on the template of its kind (built on the first figure of that kind in this process),
+# figures with dates on the x axis of a line and figures with numbers there are drawn on separate templates
+def _render_figure(job):
+    kind, path, specs = job
+    key = (kind, tuple(_axes_dated(axes_kind, spec) for axes_kind, spec in zip(FIGURE_KINDS[kind][3], specs)))
+
+    if key not in _figure_templates:
+        figsize, rows, columns, axes_kinds = FIGURE_KINDS[kind]
+        fig = mpl_figure.Figure(figsize = figsize) # no pyplot: headless, Agg canvas at save time
+        axs = fig.subplots(rows, columns, squeeze = False).ravel()
+        fig.subplots_adjust(hspace=0.5, wspace=0.5)
+        _figure_templates[key] = (fig, axs, [_axes_template(ax, axes_kind) for ax, axes_kind in zip(axs, axes_kinds)])
+
+    fig, axs, artists = _figure_templates[key]
+    for ax, axes_kind, axes_artists, spec in zip(axs, FIGURE_KINDS[kind][3], artists, specs):
+        _axes_update(ax, axes_kind, axes_artists, spec)
+
+    fig.savefig(path)
+    return path
+# writes figures (kind, name, specs) as <directory>/<name>.png, workers: number of processes (1 = serial)
+# jobs are grouped by kind so a worker mostly redraws the same template
+@traced
+def render_figures(jobs, directory, workers = None):
+    os.makedirs(directory, exist_ok = True)
+    tasks = sorted([(kind, os.path.join(directory, name + '.png'), specs) for kind, name, specs in jobs], key = lambda job: job[0])
+
+    if workers == 1 or len(tasks) < 2:
+        return list(map(_render_figure, tasks))
+
+    workers = os.cpu_count() if workers is None else workers
+    with Pool(workers) as pool:
+        return list(pool.imap_unordered(_render_figure, tasks, chunksize = max(1, len(tasks) // (4 * workers))))
+# renders the figures queued since enable_report() and empties the queue
+def render_report(workers = None):
+    if _report is None or len(_report['jobs']) == 0:
+        return []
+
+    paths = render_figures(_report['jobs'], _report['directory'], workers)
+    _report['jobs'] = []
+    return paths
+# figures of every symbol of a panel (output of panel()): price, position frequencies and inputs
+def panel_figures(frame):
+    jobs = []
+
+    for ticker, data in frame.groupby(level = 'ticker'):
+        data = data.droplevel('ticker')
+        train, test = data[data['split'] == 'train'], data[data['split'] == 'test']
+
+        jobs.append(('line', ticker + '_price', [{'x': data.index.to_numpy(), 'y': [data['Adj Close'].to_numpy()], 'title': ticker,
+                                                  'xlabel': 'Time', 'ylabel': 'Adj Close'}]))
+        jobs.append(('bars', ticker + '_positions', [position_bars(train, test, ticker)]))
+        jobs.append(('inputs', ticker + '_inputs', input_specs(train)))
+
+    return jobs
+# position frequencies of the train and test sets
+def position_bars(data, data_test, ticker):
+    return {'x': [0, 1], 'heights': [data['position'].value_counts().reindex([0, 1], fill_value = 0).to_numpy(),
+                                     data_test['position'].value_counts().reindex([0, 1], fill_value = 0).to_numpy()],
+            'title': ticker}
+# axes of the conditional distributions plot: (column, title, label), an input missing from data leaves its axes empty
+INPUT_PLOTS = [('RSI', 'Relative Strenght Index', 'RSI'), ('MA', '20 days moving average', 'moving average'),
+               ('D', 'smoothed stochastic oscillator', 'oscillator'), ('adx', 'Average Directional Index', 'ADX'),
+               ('OBV', 'On-Balance Volume', 'OBV'), ('boll_up', 'Upper Bollinger Band', 'Bollinger Band')]
+def input_specs(data):
+    return [{'x': data['position'].to_numpy() if column in data else [], 'y': data[column].to_numpy() if column in data else [],
+             'title': title, 'xlabel': 'position', 'ylabel': label} for column, title, label in INPUT_PLOTS]
+# plots of conditional distributions with respect to inputs
+def inputPlots(data, name = 'inputs'):
+    show_figure('inputs', name, input_specs(data))
 # Neural net architecture
-def NeuralNet():
-        NN = Sequential()
+def NeuralNet(jit_compile = False):
+        NN = keras.Sequential()
 
         NN.add(layers.Dense(10, activation='relu'))
         NN.add(layers.Dense(10, activation='relu'))
@@ -461,58 +2098,46 @@ def NeuralNet():
         NN.compile(optimizer='adam',
                    loss=keras.losses.SparseCategoricalCrossentropy(),
                    metrics=keras.metrics.SparseCategoricalCrossentropy(),
+                   jit_compile=jit_compile, # XLA: one fused kernel per train step (fast_fit)
                    )
 
         NN._name = 'Neural_Network'
 
         return NN
 # AUC + ROC + confusion matrix (in case of binary buy/sell classification)
-def results(y, pred_class, model, ticker):
-    fig, axs  = plt.subplots(1, 2, figsize = (10, 5))
-
-    fpr, tpr, thr = roc_curve(y, pred_class)
-    roc_auc = auc(fpr, tpr)
+def results(y, pred_class, model, ticker, name = 'results'):
+    fpr, tpr, thr = metrics.roc_curve(y, pred_class)
+    roc_auc = metrics.auc(fpr, tpr)
     print(model, roc_auc)
 
-    axs[0].plot(fpr, tpr, lw=2, alpha=0.7, label=model)
-    axs[0].plot([0, 1], [0, 1], linestyle='--', lw=2, color='r', alpha=.8)
-    axs[0].set_xlabel('False Positive Rate')
-    axs[0].set_ylabel('True Positive Rate')
-    axs[0].set_title(ticker)
-
-    axs[1].plot(history.history['loss'])
-    axs[1].set_xlabel('Epochs')
-    axs[1].set_ylabel('Loss')
+    show_figure('results', name, [{'fpr': fpr, 'tpr': tpr, 'label': str(model), 'title': ticker},
+                                  {'y': [model.history.history['loss']], 'xlabel': 'Epochs', 'ylabel': 'Loss'}])
 
-    conf_mat = confusion_matrix(pred_class, y)
-    report = classification_report(pred_class, y)
+    conf_mat = metrics.confusion_matrix(pred_class, y)
+    report = metrics.classification_report(pred_class, y)
     print(report, conf_mat)
 # ROC curve + confusion matrix
-def roc(y, pred_class, model, ticker, model_name):
-    fpr, tpr, thr = roc_curve(y, pred_class)
-    roc_auc = auc(fpr, tpr)
+def roc(y, pred_class, model, ticker, model_name, name = 'roc'):
+    fpr, tpr, thr = metrics.roc_curve(y, pred_class)
+    roc_auc = metrics.auc(fpr, tpr)
     print(model, roc_auc)
 
-    plt.plot(fpr, tpr, lw=2, alpha=0.7, label=model_name)
-    plt.plot([0, 1], [0, 1], linestyle='--', lw=2, color='r', alpha=.8)
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    plt.title(ticker)
-    plt.legend()
-    plt.show()
+    show_figure('roc', name, [{'fpr': fpr, 'tpr': tpr, 'label': model_name, 'title': ticker}])
 
-    conf_mat = confusion_matrix(pred_class, y)
-    report = classification_report(pred_class, y)
+    conf_mat = metrics.confusion_matrix(pred_class, y)
+    report = metrics.classification_report(pred_class, y)
     print(report, conf_mat)
-# learning curve
-def learning_curve(model, ticker):
-    plt.plot(history.history['loss'])
-    plt.xlabel('Epochs')
-    plt.ylabel('Loss')
-    plt.title(ticker)
+# learning curve (keras models, which keep the history of their last fit)
+# loss: loss per epoch instead of the model's history (e.g. a row of train_models)
+def learning_curve(model, ticker, name = 'learning_curve', loss = None):
+    if loss is None and getattr(model, 'history', None) is None:
+        return
+
+    loss = model.history.history['loss'] if loss is None else loss
+    show_figure('line', name, [{'y': [loss], 'xlabel': 'Epochs', 'ylabel': 'Loss', 'title': ticker}])
 # Second Neural Net architecture
-def ImprovedNeuralNet():
-        NN = Sequential()
+def ImprovedNeuralNet(jit_compile = False):
+        NN = keras.Sequential()
 
         NN.add(layers.Dense(32, activation='relu'))
         NN.add(layers.Dense(32, activation='relu'))
@@ -522,11 +2147,569 @@ def ImprovedNeuralNet():
         NN.compile(optimizer='adam',
                    loss=keras.losses.BinaryCrossentropy(),
                    metrics=keras.metrics.BinaryCrossentropy(),
+                   jit_compile=jit_compile,
                    )
 
         NN._name = 'Improved_Neural_Net'
 
         return NN
+# fast training mode of the neural nets: large batches, XLA-compiled steps, early stopping on the most recent train rows
+FAST_FIT = {'batch_size': 1024, 'validation': 0.2, 'patience': 20}
+# (X, y) batches through tf.data: converted once and cached, reshuffled each pass (train only), prefetched while a step runs
+# repeated, so one iterator serves every epoch (fit with steps_per_epoch) instead of a new one per epoch
+def fast_dataset(X, y, batch_size, shuffle = False, seed_value = 100):
+    dataset = tf.data.Dataset.from_tensor_slices((X, y)).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(X), seed = seed_value, reshuffle_each_iteration = True)
+    return dataset.batch(batch_size).repeat().prefetch(tf.data.AUTOTUNE)
+# fits a compiled net (built with jit_compile = True for XLA) for at most `epochs` epochs on the first rows of the train split,
+# the last `validation` fraction is held out in time order and training stops `patience` epochs after its best loss
+# (best weights restored), returns the keras History (loss, val_loss) and the epochs per second
+def fast_fit(model, X, y, epochs = 500, batch_size = 1024, validation = 0.2, patience = 20, seed_value = 100, verbose = 0):
+    X, y = np.asarray(X), np.asarray(y)
+    split = len(X) - max(1, int(round(len(X) * validation))) if validation > 0 else len(X)
+    callbacks = []
+
+    if split < len(X):
+        # one compiled call on the whole held-out block per epoch, much cheaper than fit's own validation pass
+        X_valid, y_valid = tf.constant(X[split:]), tf.constant(y[split:])
+        valid_loss = tf.function(lambda: model.loss(y_valid, model(X_valid, training = False)), jit_compile = True)
+        callbacks.append(keras.callbacks.LambdaCallback(on_epoch_end = lambda epoch, logs: logs.update(val_loss = float(valid_loss()))))
+
+    callbacks.append(keras.callbacks.EarlyStopping(monitor = 'val_loss' if callbacks else 'loss', patience = patience,
+                                                   restore_best_weights = True))
+
+    train = fast_dataset(X[:split], y[:split], batch_size, shuffle = True, seed_value = seed_value)
+
+    t0 = time.perf_counter()
+    history = model.fit(train, epochs = epochs, steps_per_epoch = -(-split // batch_size), callbacks = callbacks, verbose = verbose)
+    seconds = time.perf_counter() - t0
+
+    rate = len(history.history['loss']) / seconds
+    print(model.name, ': ', len(history.history['loss']), ' epochs in ', round(seconds, 2), 's  (', round(rate, 1), ' epochs/s)')
+
+    return history, rate
+# LSTM windows as a zero-copy view: window p is X[p : p + n] (shape (len(X) - n + 1, n, features), no data copied)
+def lstm_windows(X, n):
+    X = np.asarray(X)
+    return sliding_window_view(X, (n, X.shape[1]))[:, 0]
+# batches of (X[p - n : p], y[p]) built on the fly from X, memory does not grow with the window length n
+def lstm_dataset(X, y, n, batch_size = 32, shuffle = False):
+    return keras.preprocessing.timeseries_dataset_from_array(X[:-1], y[n:], sequence_length = n, batch_size = batch_size,
+                                                             shuffle = shuffle, seed = 100)
+# LSTM architecture
+def lstm_net(n, features):
+    model = keras.Sequential()
+    model.add(layers.LSTM(64, input_shape = (n, features)))
+    model.add(layers.Dense(1, activation = 'sigmoid'))
+
+    model.compile(loss = keras.losses.BinaryCrossentropy(),
+                  metrics = keras.metrics.BinaryCrossentropy(),
+                  optimizer = "adam")
+
+    model._name = 'LSTM'
+
+    return model
+# LSTM on n-days windows of the (train) features, fed from a windowed dataset instead of stacked window copies
+@traced
+def lstm(X, y, n = 14, epochs = 100, batch_size = 32):
+    scaler = preprocessing.MinMaxScaler(feature_range = [0, 1]).fit(X)
+    X = model_input(scaler.transform(X), 'keras')
+    y = np.asarray(y, dtype = np.float32)
+
+    model = lstm_net(n, X.shape[1])
+    history = model.fit(lstm_dataset(X, y, n, batch_size), epochs = epochs)
+
+    pred = model.predict(lstm_dataset(X, y, n, batch_size)) # Predicted probabilities on train data
+    pred_class = (pred[:, 0] > 0.5).astype(int) # Predicted class on train data
+
+    return model, scaler, history, y[n:], pred_class
+# Model-run queue: the models of the study fitted on one shared, scaled copy of each split, concurrently in a process pool
+# the study's linear SVM (libsvm defaults)
+def LinearSVM():
+    return svm.SVC()
+# model specs: name -> kind (fit/predict protocol and model_input dtype), build (unfitted model), fit arguments, scaled inputs
+# 'search' runs rbf_search with the fit arguments as its grid, 'logit' is MNLogit on the unscaled features as in the study
+MODEL_SPECS = {
+    'MNLogit': {'kind': 'logit', 'build': None, 'fit': {'method': 'newton', 'maxiter': 100, 'disp': 0}, 'scale': False},
+    'Neural Network': {'kind': 'keras', 'build': NeuralNet, 'fit': {'epochs': 500, 'verbose': 0}, 'scale': True},
+    'Improved Neural Network': {'kind': 'keras', 'build': ImprovedNeuralNet, 'fit': {'epochs': 1000, 'verbose': 0}, 'scale': True},
+    'linear SVM': {'kind': 'svm', 'build': LinearSVM, 'fit': {}, 'scale': True},
+    'Kernel SVM': {'kind': 'search', 'build': None, 'scale': True,
+                   'fit': {'C': [0.001, 0.01, 0.1, 1, 10, 100], 'gamma': [10, 1, 0.1, 0.01, 0.001, 0.0001, 0.00001]}},
+}
+# thread pools read from the environment when the math libraries load, set for the workers before they start
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']
+_training_data = None # splits of the running queue and threads per model, set once per worker process
+_training_inputs = {} # (split, scaled, dtype) -> model input, converted once per worker
+def _training_worker(data):
+    global _training_data, _trace, _trace_start
+
+    _training_data = data
+    _training_inputs.clear()
+
+    if data.get('trace_start') is not None: # spawned worker of a traced run: its events go back to the parent with the results
+        _trace, _trace_start = [], data['trace_start']
+# features of a split for one model, scaled or not, in the dtype of its kind (see MODEL_DTYPES)
+def training_input(split, scaled, kind):
+    kind = 'svm' if kind == 'search' else kind
+    key = (split, scaled, MODEL_DTYPES[kind])
+
+    if key not in _training_inputs:
+        _training_inputs[key] = model_input(_training_data[split + ('_scaled' if scaled else '')], kind)
+
+    return _training_inputs[key]
+# 0/1 class of each row from the output of a model's predict
+def predicted_class(out, kind):
+    out = np.asarray(out)
+    if out.ndim == 2 and out.shape[1] > 1: # class probabilities (MNLogit, softmax)
+        out = out.argmax(axis = 1)
+    elif kind == 'keras': # one sigmoid output
+        out = (out.reshape(-1) > 0.5).astype(int)
+    return out.reshape(-1).astype(int)
+# Model registry: fitted models and scalers stored once under a content key, reloaded instead of refitted
+# pickles obj with its large contiguous arrays (inline bytes or more) out of band (protocol 5): the pickle stream goes to
+# path + '.pkl' and the array buffers, 64-byte aligned, to path + '.bin', where load_mapped maps them back without copying
+def dump_mapped(obj, path, inline = 2 ** 16):
+    buffers = []
+
+    def out_of_band(buffer):
+        if buffer.raw().nbytes < inline:
+            return True # kept in the pickle stream
+        buffers.append(buffer)
+
+    payload = pickle.dumps(obj, protocol = 5, buffer_callback = out_of_band)
+    offsets = []
+    position = 0
+
+    with open(path + '.bin', 'wb') as f:
+        for buffer in buffers:
+            raw = buffer.raw()
+            f.write(bytes(-position % 64))
+            position += -position % 64
+            offsets.append((position, raw.nbytes))
+            f.write(raw)
+            position += raw.nbytes
+
+    with open(path + '.pkl', 'wb') as f:
+        pickle.dump((offsets, payload), f, protocol = pickle.HIGHEST_PROTOCOL)
+# copy-on-write map: the arrays stay writable (libsvm asks for it) while their pages are read from disk on first use
+# and shared by every process that loads the same file
+def load_mapped(path):
+    with open(path + '.pkl', 'rb') as f:
+        offsets, payload = pickle.load(f)
+
+    mapped = np.memmap(path + '.bin', mode = 'c') if len(offsets) > 0 else None
+
+    return pickle.loads(payload, buffers = [mapped[offset : offset + size] for offset, size in offsets])
+# short hash of the full indicator parameter set, recorded with the models fitted on these features
+def params_hash(params = None):
+    return hashlib.sha1(json.dumps(indicator_params(params), sort_keys = True).encode()).hexdigest()[:16]
+# feature schema of a model matrix: column names and dtypes, the indicator parameters (and their hash) behind them
+# and the first bar of the history the indicators were computed from (OBV is a running total from it), when given
+def feature_schema(X, params = None, start = None):
+    schema = {'columns': [str(col) for col in X.columns], 'dtypes': [str(dtype) for dtype in X.dtypes],
+              'params': indicator_params(params), 'params_hash': params_hash(params)}
+    if start is not None:
+        schema['start'] = pd.Timestamp(start).isoformat()
+    return schema
+# directory of entries <key>/ holding meta.json and the model: keras format for the nets, dump_mapped for the others
+# the key hashes the training data, the spec (kind, builder, fit arguments, scaling), the seed, the fast_fit arguments
+# and the feature schema, so a model is only fitted once for the same inputs; runs/<name>.json lists the entries of a run
+class ModelRegistry:
+
+    version = 1 # part of every key, bumped whenever the training of a kind changes
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, X, y, spec, seed_value = 100, fast = None, schema = None):
+        meta = {'version': self.version, 'kind': spec['kind'], 'build': getattr(spec['build'], '__name__', None),
+                'fit': spec.get('fit'), 'scale': spec.get('scale'), 'seed': seed_value, 'fast': fast, 'schema': schema}
+
+        digest = hashlib.sha1(json.dumps(meta, sort_keys = True, default = str).encode())
+        digest.update(np.ascontiguousarray(X, dtype = float).tobytes())
+        digest.update(np.ascontiguousarray(y).tobytes())
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    # (model, meta) of an entry, None when it is not stored
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path(key), 'meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if meta['kind'] == 'keras':
+            model = keras.models.load_model(os.path.join(self.path(key), 'model.keras'), compile = False) # inference only
+        else:
+            model = load_mapped(os.path.join(self.path(key), 'model'))
+
+        return model, meta
+
+    def put(self, key, model, meta):
+        os.makedirs(self.directory, exist_ok = True)
+
+        # written in a temporary directory then renamed, so concurrent processes never read half an entry
+        tmp = self.path(key) + '.' + str(os.getpid()) + '.tmp'
+        os.makedirs(tmp, exist_ok = True)
+
+        if meta['kind'] == 'keras':
+            model.save(os.path.join(tmp, 'model.keras'))
+        else:
+            if meta['kind'] == 'logit':
+                model.remove_data() # the fitted parameters are enough to predict
+            dump_mapped(model, os.path.join(tmp, 'model'))
+
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent = 1, default = float)
+
+        try:
+            os.rename(tmp, self.path(key))
+        except OSError: # stored meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors = True)
+
+    def run_path(self, name):
+        return os.path.join(self.directory, 'runs', quote(name, safe = '') + '.json')
+
+    # run: {'schema': feature_schema, 'scaler': key, 'models': {name: {'key', 'kind', 'scale'}}}
+    def put_run(self, name, run):
+        os.makedirs(os.path.dirname(self.run_path(name)), exist_ok = True)
+
+        tmp = self.run_path(name) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(run, f, indent = 1)
+        os.replace(tmp, self.run_path(name))
+
+    def run(self, name):
+        with open(self.run_path(name)) as f:
+            return json.load(f)
+# fits one model spec on the train split and predicts both splits, returns its metrics row, predictions and the trace
+# events recorded in a worker process (stage name.fit and name.predict)
+def train_model(job):
+    name, spec, seed_value, key = job
+    kind = spec['kind']
+    registry = _training_data['registry']
+    y, y_test = _training_data['y'], _training_data['y_test']
+    X, X_test = training_input('X', spec['scale'], kind), training_input('X_test', spec['scale'], kind)
+    loss, params = None, None
+
+    np.random.seed(seed_value)
+    t0 = time.perf_counter()
+
+    with stage(name + '.fit', len(X)):
+        stored = None if registry is None else registry.get(key)
+
+        if stored is not None: # fitted before on the same inputs
+            model, meta = stored
+            loss, params = meta['loss'], meta['params']
+        elif kind == 'logit':
+            model = sm.MNLogit(y, X).fit(**spec['fit'])
+        elif kind == 'search':
+            search, model = rbf_search(X, y, workers = _training_data['threads'] or -1, **spec['fit'])
+            params = search.best_params_
+        elif kind == 'keras':
+            if _training_data['threads'] is not None:
+                try: # only possible before tensorflow starts its thread pools
+                    tf.config.threading.set_intra_op_parallelism_threads(_training_data['threads'])
+                    tf.config.threading.set_inter_op_parallelism_threads(1)
+                except RuntimeError:
+                    pass
+            tf.random.set_seed(seed_value)
+            if _training_data['fast'] is not None:
+                model = spec['build'](jit_compile = True)
+                history = fast_fit(model, X, y, epochs = spec['fit']['epochs'], seed_value = seed_value, **_training_data['fast'])[0]
+            else:
+                model = spec['build']()
+                history = model.fit(X, y, **spec['fit'])
+            loss = history.history['loss']
+        else:
+            model = spec['build']().fit(X, y)
+
+    fit_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+
+    with stage(name + '.predict', len(X) + len(X_test)):
+        pred = [predicted_class(model.predict(features, verbose = 0) if kind == 'keras' else model.predict(features), kind)
+                for features in (X, X_test)]
+
+    row = {'model': name, 'kind': kind, 'fit_seconds': fit_seconds, 'predict_seconds': time.perf_counter() - t0,
+           'accuracy_train': np.mean(pred[0] == y), 'accuracy_test': np.mean(pred[1] == y_test),
+           'auc_test': metrics.roc_auc_score(y_test, pred[1]) if len(np.unique(y_test)) == 2 else np.nan,
+           'params': params, 'loss': loss, 'epochs': np.nan if loss is None else len(loss),
+           'epochs_per_second': np.nan if loss is None else len(loss) / fit_seconds, 'stored': stored is not None, 'pid': os.getpid()}
+
+    if registry is not None and stored is None:
+        registry.put(key, model, {'name': name, 'kind': kind, 'loss': loss, 'params': params, 'fit_seconds': fit_seconds,
+                                  'schema': _training_data['schema']})
+
+    events = []
+    if _training_data.get('trace_start') is not None:
+        events = list(_trace)
+        _trace.clear()
+
+    return row, pred, events
+# fits every model spec (names of MODEL_SPECS, or name -> spec) on the train split and predicts both splits
+# the features are scaled once per split (MinMaxScaler fitted on the train split), workers: processes (1 = serial here),
+# each worker runs with cpu_count / workers threads so tensorflow and BLAS do not oversubscribe the cores
+# fast: fast_fit arguments for the neural nets (True for FAST_FIT, None for the study's plain fit)
+# registry: ModelRegistry the models and the scaler are read from (fitted before on the same inputs) or stored in,
+# run: name the entries of this run are listed under (for ScoringService), params: the indicator parameters of the features,
+# start: first bar of the price history the features were computed from (recorded in the schema, ScoringService loads from it)
+# returns the metrics table (one row per model, in the order of specs), the predictions indexed by (model, split, row) and the scaler
+@traced
+def train_models(X, y, X_test, y_test, specs = None, workers = None, seed_value = 100, fast = None, registry = None,
+                 run = None, params = None, start = None):
+    specs = dict(MODEL_SPECS) if specs is None else specs
+    specs = {name: MODEL_SPECS[name] for name in specs} if not isinstance(specs, dict) else specs
+    schema = feature_schema(X, params, start) if isinstance(X, pd.DataFrame) else None
+    fast = dict(FAST_FIT) if fast is True else fast
+
+    # no upcast here: the splits keep the matrix's dtype (float32 for a compact one), the scaler works in its own dtype
+    # and training_input converts explicitly for each model
+    X, X_test = np.asarray(X), np.asarray(X_test)
+    y = np.asarray(y)
+
+    scaler_spec = {'kind': 'scaler', 'build': preprocessing.MinMaxScaler, 'fit': {'feature_range': [0, 1]}}
+    scaler_key = None if registry is None else registry.key(X, y, scaler_spec, schema = schema)
+    stored = None if registry is None else registry.get(scaler_key)
+
+    if stored is None:
+        scaler = preprocessing.MinMaxScaler(feature_range = [0, 1]).fit(model_input(X, 'scaler'))
+        if registry is not None:
+            registry.put(scaler_key, scaler, {'name': 'scaler', 'kind': 'scaler', 'schema': schema})
+    else:
+        scaler = stored[0]
+
+    data = {'X': X, 'X_test': X_test, 'X_scaled': scaler.transform(model_input(X, 'scaler')),
+            'X_test_scaled': scaler.transform(model_input(X_test, 'scaler')),
+            'y': y, 'y_test': np.asarray(y_test), 'fast': fast, 'registry': registry, 'schema': schema}
+
+    jobs = [(name, spec, seed_value, None if registry is None else registry.key(X, y, spec, seed_value, fast if spec['kind'] == 'keras' else None, schema))
+            for name, spec in specs.items()]
+    workers = min(len(jobs), os.cpu_count()) if workers is None else workers
+    t0 = time.perf_counter()
+
+    if workers == 1:
+        _training_worker(dict(data, threads = None)) # events are recorded here directly
+        outputs = list(map(train_model, jobs))
+    else:
+        threads = max(1, os.cpu_count() // workers)
+        saved = {var: os.environ.get(var) for var in THREAD_VARIABLES + ['TF_NUM_INTEROP_THREADS']}
+        os.environ.update({var: str(threads) for var in THREAD_VARIABLES}, TF_NUM_INTEROP_THREADS = '1')
+
+        try:
+            # spawned, not forked: a worker never inherits a tensorflow runtime already started here
+            trace_start = None if _trace is None else _trace_start
+            with multiprocessing.get_context('spawn').Pool(workers, _training_worker, (dict(data, threads = threads, trace_start = trace_start),)) as pool:
+                outputs = pool.map(train_model, jobs, chunksize = 1)
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    if registry is not None and run is not None: # listed once every model is stored
+        registry.put_run(run, {'schema': schema, 'scaler': scaler_key,
+                               'models': {name: {'key': key, 'kind': spec['kind'], 'scale': spec['scale']}
+                                          for name, spec, seed_value, key in jobs}})
+
+    if _trace is not None: # perf_counter is shared by the processes, the workers' events line up with the parent's
+        _trace.extend(event for row, pred, events in outputs for event in events)
+
+    table = pd.DataFrame([row for row, pred, events in outputs]).set_index('model')
+    predictions = pd.concat([pd.DataFrame({'model': row['model'], 'split': split, 'row': np.arange(len(p)), 'pred': p})
+                             for row, pred, events in outputs for split, p in zip(['train', 'test'], pred)], ignore_index = True)
+
+    print('models : ', len(jobs), ' stored : ', table['stored'].sum(), ' workers : ', workers,
+          ' wall time : ', round(time.perf_counter() - t0, 2), 's  fit time : ', round(table['fit_seconds'].sum(), 2), 's')
+
+    return table, predictions.set_index(['model', 'split', 'row']), scaler
+# Scoring service: next-bar buy/sell signals of a universe of tickers from the models of a run of train_models(registry = ...)
+# indicator stream of a ticker for the service (see latest_feature_row): the stream, the date of the last bar it was
+# fed, the closes of its last two bars and the indicators of its last bar
+def scoring_state(params):
+    return {'stream': IndicatorStream(**{name: params[name] for name in INDICATOR_PARAMS if name != 'adx_causal'}),
+            'last': None, 'closes': deque(maxlen = 2), 'before': None}
+# features() row of the latest bar of a ticker from its indicator stream (state: scoring_state, None the first time):
+# the bars after the last one fed are loaded (the whole history from start the first time) and fed one at a time;
+# the latest bar is fed on a snapshot of the stream, so it is fed again, maybe revised, with the next request
+# the row pairs the close of the bar before with the indicators of the latest bar, as features() does (signals that
+# the models were not fitted on are left out), returns the ticker, the row, the date of the latest bar, the new state
+# and the error (no state then: the ticker's history is replayed on its next request)
+def latest_feature_row(args):
+    ticker, loader, start, end, state, params, extra, columns = args
+
+    try:
+        state = scoring_state(params) if state is None else state
+        data = loader(ticker, start if state['last'] is None else state['last'], end)
+        if state['last'] is not None:
+            data = data[data.index > state['last']]
+        if len(data) == 0:
+            raise ValueError('no bar after ' + str(state['last']))
+
+        stream = state['stream']
+        bars = data[['High', 'Low', 'Adj Close', 'Volume']].to_dict('records')
+
+        for bar, date in zip(bars[:-1], data.index[:-1]):
+            state['before'] = stream.update(bar)
+            state['closes'].append(bar['Adj Close'])
+            state['last'] = date
+
+        if not stream.ready() or len(state['closes']) < 2:
+            raise ValueError('fewer bars than the warm-up of the indicators')
+
+        saved = stream.snapshot()
+        now = stream.update(bars[-1])
+        stream.restore(saved)
+
+        operands = {name: np.array([state['before'][name], now[name]]) for name in now}
+        operands['price'] = np.array(state['closes'])
+        values = dict({name: now[name] for name in ['adx', 'OBV'] + extra}, **{'Adj Close': state['closes'][-1]})
+        for name, rule in SIGNAL_RULES.items():
+            values[name + '_' + str(signal_codes(rule, operands)[1])] = 1
+
+        return ticker, np.array([values.get(col, 0) for col in columns], dtype = float), data.index[-1], state, None
+    except Exception as e: # one bad symbol must not fail the request
+        return ticker, None, None, None, repr(e)
+# the scaler and models are loaded once, the indicator stream of every ticker is kept between requests, so a request
+# only loads and feeds the bars since the one before (in `workers` processes, started before tensorflow loads) and runs
+# one batched predict per model on the whole universe; latencies of the last `window` requests are kept per stage
+# start: first bar of the histories, recorded with the run (OBV is a running total from it), for runs recording none
+class ScoringService:
+
+    def __init__(self, registry, run, loader, start = None, workers = 1, window = 1000):
+        self.workers = workers
+        self.pool = None if workers == 1 else Pool(processes = workers)
+
+        registry = ModelRegistry(registry) if isinstance(registry, str) else registry
+        meta = registry.run(run)
+
+        self.loader = loader
+        self.scaler = registry.get(meta['scaler'])[0]
+        self.columns = meta['schema']['columns']
+        self.params = indicator_params(meta['schema']['params'])
+
+        # the study's adx of the latest bar averages the dx of the bars after it, which do not exist yet (zeros): about
+        # 6 / n of the scale the models were fitted on, so only runs trained on the causal adx are served
+        if 'adx' in self.columns and not self.params['adx_causal']:
+            raise ValueError('run ' + repr(run) + " was fitted on the study's adx, which reads bars after the latest one: "
+                             'train it with --causal-adx (params = {"adx_causal": True}) to serve it')
+
+        start = meta['schema'].get('start', start)
+        if start is None:
+            raise ValueError('run ' + repr(run) + ' records no start date for its histories, pass start')
+        self.start = pd.Timestamp(start)
+
+        self.extra = [col for col in self.columns if col in INDICATOR_COLUMNS + ['DI_plus', 'DI_minus'] and col not in ['adx', 'OBV']]
+        self.models = {name: (spec['kind'], spec['scale'], registry.get(spec['key'])[0]) for name, spec in meta['models'].items()}
+        self.states = {} # ticker -> scoring_state
+        self.latencies = {} # stage -> deque of seconds
+        self.window = window
+
+    def record(self, stage, seconds):
+        self.latencies.setdefault(stage, deque(maxlen = self.window)).append(seconds)
+
+    # latest feature rows of the tickers (see latest_feature_row), the dates of their latest bars and the failures
+    def latest_features(self, tickers, end):
+        jobs = [(ticker, self.loader, self.start, end, self.states.get(ticker), self.params, self.extra, self.columns) for ticker in tickers]
+        results = map(latest_feature_row, jobs) if self.pool is None else \
+                  self.pool.imap(latest_feature_row, jobs, chunksize = max(1, len(jobs) // (4 * self.workers)))
+
+        scored, rows, dates, failed = [], [], [], {}
+        for ticker, row, date, state, error in results:
+            if error is None:
+                scored.append(ticker)
+                rows.append(row)
+                dates.append(date)
+                self.states[ticker] = state # the worker's copy when the rows are built in the pool
+            else:
+                self.states.pop(ticker, None)
+                failed[ticker] = error
+
+        X = np.array(rows).reshape(len(rows), len(self.columns))
+
+        return pd.DataFrame(X, index = pd.Index(scored, name = 'ticker'), columns = self.columns), dates, failed
+
+    # one frame indexed by ticker: date of the latest bar and the 0/1 (sell/buy) signal of every model, and the failures
+    def score(self, tickers, end = None):
+        end = dt.datetime.now() if end is None else end
+        t0 = time.perf_counter()
+
+        X, dates, failed = self.latest_features(tickers, end)
+        self.record('features', time.perf_counter() - t0)
+
+        signals = pd.DataFrame({'date': dates}, index = X.index)
+
+        if len(X) > 0:
+            X = X.to_numpy()
+            scaled = self.scaler.transform(model_input(X, 'scaler')) # as train_models scales
+
+            for name, (kind, scale, model) in self.models.items():
+                t1 = time.perf_counter()
+                inputs = model_input(scaled if scale else X, 'svm' if kind == 'search' else kind)
+                out = model.predict_on_batch(inputs) if kind == 'keras' else model.predict(inputs) # the whole universe at once
+                signals[name] = predicted_class(out, kind)
+                self.record(name, time.perf_counter() - t1)
+
+        self.record('total', time.perf_counter() - t0)
+
+        return signals, failed
+
+    # p50 / p99 latency (ms) of every stage over the recent requests
+    def latency(self):
+        return pd.DataFrame([{'stage': stage, 'requests': len(seconds), 'p50_ms': np.percentile(seconds, 50) * 1000,
+                              'p99_ms': np.percentile(seconds, 99) * 1000} for stage, seconds in self.latencies.items()],
+                            columns = ['stage', 'requests', 'p50_ms', 'p99_ms']).set_index('stage')
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+# stdin / stdout stand-in of the service: one request per line (tickers separated by spaces or commas, or a json list),
+# one json line back with the buy/sell signals, the failed tickers and the latencies; an empty line or EOF stops it
+def serve(service, lines = None, out = None):
+    lines = sys.stdin if lines is None else lines
+    out = sys.stdout if out is None else out
+
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            break
+
+        tickers = json.loads(line) if line.startswith('[') else line.replace(',', ' ').split()
+        signals, failed = service.score(tickers)
+
+        response = {'signals': {ticker: dict({'date': str(row['date'].date())},
+                                             **{name: 'buy' if row[name] == 1 else 'sell' for name in service.models})
+                                for ticker, row in signals.iterrows()},
+                    'failed': failed, 'latency_ms': service.latency()[['p50_ms', 'p99_ms']].round(3).to_dict('index')}
+
+        out.write(json.dumps(response) + '\n')
+        out.flush()
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog = 'PyProject.py serve', description = 'buy/sell signals of the latest bars from saved models')
+    parser.add_argument('--models', default = 'model_registry', help = 'model registry of the experiment (--models)')
+    parser.add_argument('--run', default = 'AF.PA', help = 'run whose models are used (the ticker of the experiment)')
+    parser.add_argument('--offline', default = None, help = 'folder of <ticker>.csv files to use instead of the yahoo API')
+    parser.add_argument('--start', default = None, help = 'first bar of the histories, for runs that record none')
+    parser.add_argument('--workers', type = int, default = 1, help = 'processes building the feature rows')
+    args = parser.parse_args(argv)
+
+    source = CachedSource(YahooSource(), 'data_cache') if args.offline is None else CSVSource(args.offline)
+    service = ScoringService(args.models, args.run, source, start = args.start, workers = args.workers)
+
+    try:
+        serve(service)
+    finally:
+        service.close()
+
+    return 0
 # Encodes predictions into string variables easier to read (deprecated)
 def output_encode(pred_class, data):
     list = []
@@ -542,8 +2725,8 @@ def output_encode(pred_class, data):
     data.insert(4, 'pred_pos', pred_class)
 
     return data
-# Computes profits based on predictions and returns for the S&P500 same period
-def profits_SP(data, amount):
+# Computes profits based on predictions and returns for the S&P500 same period (original loop version, kept as reference for backtest_parity)
+def profits_SP_loop(data, amount):
     init = amount
     profits = []
     total = [amount]
@@ -608,7 +2791,7 @@ def profits_SP(data, amount):
     print('total realized return : ', round(percentage_gain, 2), '%')  # sum profits and compute % return
 
     return data;
-def profits(data, amount):
+def profits_loop(data, amount):
     available = amount
     total = 0
     profit = 0
@@ -691,248 +2874,1108 @@ def profits(data, amount):
     print('total realized return', round(percentage_gain, 2), '%')  # sum profits and compute % return
 
     return backtest;
-# Counts the number of time the model is right/wrong
-def accuracy(data):
-    proportion = []
+# Vectorized backtest engine
+# capital path y[p + 1] = min(y[p] * growth[p], cap) with y[0] = cap, along the last axis
+def capped_growth(growth, cap):
+    y = np.empty(growth.shape[:-1] + (growth.shape[-1] + 1,))
+
+    if (growth > 0).all():
+        # in logs the cap is a reset of the cumulative sum: log(y / cap) = S - running max of S
+        S = np.zeros(y.shape)
+        np.cumsum(np.log(growth), axis = -1, out = S[..., 1:])
+        y = cap * np.exp(S - np.maximum.accumulate(S, axis = -1))
+    else:
+        # a log return below -1 makes the capital negative, which has no log: step through time instead
+        y[..., 0] = cap
+        for p in range(growth.shape[-1]):
+            y[..., p + 1] = np.minimum(y[..., p] * growth[..., p], cap)
+
+    return y
+# log returns between consecutive closes, along the last axis
+def log_returns(close):
+    return np.log(close[..., 1:]) - np.log(close[..., :-1])
+# buy & hold with realized profits skimmed above amount (profits_SP), close: (T,) or (strategies, T)
+# masks are applied by multiplication rather than np.where, which is several times faster on random masks
+def vec_profits_SP(close, amount):
+    close = np.asarray(close, dtype = float)
+    tx = log_returns(close)
+
+    total = capped_growth(1 + tx, amount)
+    backtest = {key : np.zeros(close.shape) for key in ['%returns', 'profits', 'realized_profits', 'realized_returns']}
+    backtest['total'] = total
+
+    # the last bar has no return, its row stays at zero
+    backtest['%returns'][..., :-1] = tx
+    profit = np.multiply(total[..., :-1], tx, out = backtest['profits'][..., :-1])
+    after = total[..., :-1] + profit
+    realized = (tx > 0) & (after > amount)
+
+    np.multiply(after - amount, realized, out = backtest['realized_profits'][..., :-1])
+    np.multiply(tx, realized, out = backtest['realized_returns'][..., :-1])
+
+    return backtest
+# strategy following predictions (profits), close: (T,), pred: (T,) or (strategies, T) with 0 = out of the market
+def vec_profits(close, pred, amount):
+    close = np.asarray(close, dtype = float)
+    pred = np.asarray(pred)
+    single = pred.ndim == 1
+    pred = np.atleast_2d(pred)
+
+    rate = log_returns(close)
+    invest = pred[:, :-1] != 0
+    steps = np.arange(invest.shape[1])
+
+    # capital is committed on the first buy, but a sell signal on bar 1 before any buy empties it (see profits_loop)
+    first = invest.argmax(axis = 1)
+    funded = invest.any(axis = 1) & (first <= 1)
+    started = funded[:, None] & (steps[None, :] >= first[:, None])
+
+    total = capped_growth(1 + rate * invest, amount)
+
+    backtest = {key : np.zeros(pred.shape) for key in ['profits', 'available', 'invested', 'realized_profits', 'realized_returns']}
+    backtest['%returns'] = np.broadcast_to(np.append(rate, 0), pred.shape)
+
+    # the last bar has no return, its row stays at zero except for the capital left available
+    capital = total[:, :-1] * started # capital at the start of each bar
+    profit = np.multiply(capital * rate, invest, out = backtest['profits'][:, :-1])
+    after = capital + profit
+
+    np.multiply(capital, ~invest, out = backtest['available'][:, :-1])
+    backtest['available'][:, 0] = amount * ~invest[:, 0]
+    backtest['available'][:, -1] = total[:, -1] * funded
+    np.multiply(after, invest, out = backtest['invested'][:, :-1])
+    np.maximum(after - amount, 0, out = backtest['realized_profits'][:, :-1])
+    np.multiply(rate, invest, out = backtest['realized_returns'][:, :-1])
+
+    if single:
+        backtest = {key : value[0] for key, value in backtest.items()}
+
+    return backtest
+# Computes profits based on predictions and returns for the S&P500 same period
+@traced
+def profits_SP(data, amount):
+    result = vec_profits_SP(data['Adj Close'].to_numpy(dtype = float), amount)
 
-    for p in range(0, len(data) - 1):
+    backtest = {'Close Price' : data['Adj Close'],
+                '%return' : result['%returns'],
+                'profits' : result['profits'],
+                'realized_profits' : result['realized_profits'],
+                'realized_returns': result['realized_returns']}
 
-        tx = (data['Adj Close'][p + 1] - data['Adj Close'][p]) / data['Adj Close'][p]
+    backtest = pd.DataFrame(backtest)
 
-        if data['position'][p] == data['pred'][p]:
-            proportion.append(1)
-        else:
-            proportion.append(0)
+    data['profit'] = result['profits']
+    data['total'] = result['total']
+    data['%returns'] = result['%returns']
+    data['realized_profits'] = result['realized_profits']
+    data['realized_returns'] = result['realized_returns']
 
-    proportion.append(0)
+    sum_returns = sum(data['%returns'])
+    sum_profits = sum(data['profit'])
+    sum_realized_profits = sum(data['realized_profits'])
+    percentage_gain = (sum_realized_profits * 100) / amount
 
-    data['proportion'] = proportion
+    print('sum profits : ', round(sum_profits, 2))
+    print('sum returns : ', round(sum_returns, 2))
+    print('sum realized returns : ', round(sum_realized_profits, 2))
+    print('total realized return : ', round(percentage_gain, 2), '%')  # sum profits and compute % return
 
     return data;
-# Sharpe ratio
-def sharpe(data, market_data):
-    returns = data['realized_returns']
-    market_returns = market_data['%returns']
+@traced
+def profits(data, amount):
+    result = vec_profits(data['Adj Close'].to_numpy(dtype = float), data['pred'].to_numpy(), amount)
+
+    backtest = {'Close Price' : data['Adj Close'],
+                '%return' : result['%returns'],
+                'position' : data['position'],
+                'pred' : data['pred'],
+                'profits' : result['profits'],
+                'available' : result['available'],
+                'invested' : result['invested'],
+                'realized_profits' : result['realized_profits'],
+                'realized_returns': result['realized_returns']}
 
-    length_period = len(data['realized_returns'])
+    backtest = pd.DataFrame(backtest)
 
-    volatility = np.std(returns) ** (250 / length_period)
-    market_volatility = np.std(market_returns) ** (250 / length_period)
+    data['available'] = result['available']
+    data['invested'] = result['invested']
+    data['%returns'] = result['%returns']
+    data['profit'] = result['profits']
+    data['realized_profits'] = result['realized_profits']
+    data['realized_returns'] = result['realized_returns']
 
-    expected_return = ((sum(returns) + 1) ** (250 / length_period)) - 1
-    expected_market_return = ((sum(market_returns) + 1) ** (250 / length_period)) - 1
+    sum_returns = sum(data['%returns'])
+    sum_profits = sum(data['profit'])
+    sum_realized_profits = sum(data['realized_profits'])
+    percentage_gain = (sum_realized_profits * 100) / amount
+
+    print('sum profits : ', round(sum_profits, 2))
+    print('sum returns : ', round(sum_returns, 2))
+    print('sum realized returns : ', round(sum_realized_profits, 2))
+    print('total realized return', round(percentage_gain, 2), '%')  # sum profits and compute % return
 
-    ratio = expected_return / volatility
-    market_ratio = expected_market_return / market_volatility
+    return backtest;
+# compares the vectorized backtests with the loop versions, returns the largest relative gap per column
+def backtest_parity(data, amount, rtol = 1e-9):
+    gap = {}
 
-    print("E[R_m]: ", round(expected_market_return, 2))
-    print("E[R_i]: ", round(expected_return, 2))
-    print("Volatility market: ", round(market_volatility, 2))
-    print("Volatility asset: ", round(volatility, 2))
-    print("Sharpe market: ", round(market_ratio, 2))
-    print("Sharpe asset: ", round(ratio, 2))
-# Sortino ratio
-def sortino(data, market_data, T):
-    down = []
-    down_market = []
-    market_returns = market_data['%returns']
-    returns = data['realized_returns']
-    length_period = len(market_data)
-
-    for p in range(0, length_period):
-        if data['realized_returns'][p] < T:
-            down.append(data['realized_returns'][p])
-        if market_data['%returns'][p] < T:
-            down_market.append(market_data['%returns'][p])
-
-    semi_dev = np.std(down) ** (250 / length_period)
-    market_semi_dev = np.std(down_market) ** (250 / length_period)
-
-    expected_return = ((sum(returns) + 1) ** (250 / length_period)) - 1
-    expected_market_return = ((sum(market_returns) + 1) ** (250 / length_period)) - 1
-
-    ratio = expected_return / semi_dev
-    market_ratio = expected_market_return / market_semi_dev
-
-    print("sigma down asset: ", round(semi_dev, 2))
-    print("sigma down market: ", round(market_semi_dev, 2))
-    print("sortino asset: ", round(ratio, 2))
-    print("sortino market: ", round(market_ratio, 2))
-
-# Choosing assets
-ticker = 'AF.PA' #Walmart:WMT - Apple:AAPL - AirFrance:AF.PA - Tesla:TSLA
-ticker_SP = '^GSPC' # ticker for the S&P500
-
-start = dt.datetime(2010,8,1) # series starts on 2010/08/01
-end = dt.datetime(2019,12,31) # ends on 2019/12/31
-
-# importing data from yahoo API
-data = web.DataReader(ticker, 'yahoo', start, end)
-data_SP = web.DataReader(ticker_SP, 'yahoo', start, end)
-
-# plot of the serie
-plt.plot(data['Adj Close'])
-plt.show()
-plt.title(ticker)
-plt.ylabel('Adj Close')
-plt.xlabel('Time')
-
-data = encode(data) # encodes data into buy/hold/sell and add indicators
+    for fast, slow in [(profits(data.copy(), amount), profits_loop(data.copy(), amount)),
+                       (profits_SP(data.copy(), amount), profits_SP_loop(data.copy(), amount))]:
+        for col in fast.columns:
+            if col in gap or fast[col].dtype == object:
+                continue
 
-data = transform(data) # transform the indicators from raw value to signal
-
-train_size = 0.7 # 70% of the data to training 30% to testing
+            a = fast[col].to_numpy(dtype = float)
+            b = slow[col].to_numpy(dtype = float)
 
-# Spliting data into training and testing sets
-data, data_test, X, y, X_test, y_test = test_train_split(data, train_size)
-data_SP, data_SP_test = test_train_SP(data_SP, train_size)
+            assert np.allclose(a, b, rtol = rtol, atol = 1e-9), col
 
-# position frequencies (test VS train)
-plt.bar(data['position'].value_counts().index, data['position'].value_counts().values)
-plt.bar(data_test['position'].value_counts().index, data_test['position'].value_counts().values)
-plt.title(ticker)
-plt.show()
-
-inputPlots(data) # plots of conditional distributions with respect to inputs
-
-# Logit
-logit = sm.MNLogit(y, X)
-logit_fit = logit.fit(method = 'newton', maxiter = 100)
-logit_fit.summary()
-
-#Normalize features
-scaler = MinMaxScaler(feature_range = [0, 1]).fit(X)
-X = scaler.transform(X) # Train data
-
-scaler = MinMaxScaler(feature_range = [0, 1]).fit(X_test)
-X_test = scaler.transform(X_test) # Test data
-
-# Standard Neural Net
-NN = NeuralNet() # creates Neural Net
-history = NN.fit(X, y, epochs = 500) # fits the model
-pred = NN.predict(X) # Predicted probabilities on train data
-pred_class = pred.argmax(axis = -1) # Predicted class on train data
-pred_proba =  NN.predict_proba(X)[:, 1] # computes predicted probabilities for each class
-pred_class_test = NN.predict_classes(X_test)
+            gap[col] = np.max(np.abs(a - b) / np.maximum(np.abs(b), 1))
 
-roc(y, pred_class, NN, ticker, 'Neural Network') # ROC + confusion matrix train data
-roc(y_test, pred_class_test, NN, ticker, 'Neural Network') # ROC + confusion matrix test data
-learning_curve(NN, ticker) # learning cruve
+    return pd.Series(gap)
+# Counts the number of time the model is right/wrong
+@traced
+def accuracy(data):
+    proportion = []
 
-data_test['pred'] = pred_class_test # adding predictions as 0/1 to the dataframe
-data_test = accuracy(data_test) # Counts the number of time the model is right/wrong
+    for p in range(0, len(data) - 1):
 
-# Improved Neural Net
-ImprovNN = ImprovedNeuralNet() # creates Neural Net
-history = ImprovNN.fit(X, y, epochs = 1000) # fits the model
-pred = ImprovNN.predict(X) # Predicted probabilities on train data
-pred_class = ImprovNN.predict_classes(X) # Predicted class on train data
-pred_class_test = ImprovNN.predict_classes(X_test) # Predicted class on test data
+        tx = (data['Adj Close'][p + 1] - data['Adj Close'][p]) / data['Adj Close'][p]
 
-roc(y, pred_class,ImprovNN, ticker, 'Improved Neural Network') # ROC + confusion matrix train data
-roc(y_test, pred_class_test,ImprovNN, ticker, 'Improved Neural Network') # ROC + confusion matrix test data
-learning_curve(ImprovNN, ticker) # learning cruve
+        if data['position'][p] == data['pred'][p]:
+            proportion.append(1)
+        else:
+            proportion.append(0)
 
-data_test['pred'] = pred_class_test # adding predictions as 0/1 to the dataframe
-data_test = accuracy(data_test) # Counts the number of time the model is right/wrong
+    proportion.append(0)
 
-# linear SVM
-SVM = svm.SVC()
-SVM_fit = SVM.fit(X, y)
-pred_class = SVM.predict(X)
-pred_class_test = SVM.predict(X_test)
+    data['proportion'] = proportion
 
-roc(y, pred_class, SVM, ticker, 'linear SVM') # ROC + confusion matrix train data
-roc(y_test, pred_class_test, SVM, ticker, 'linear SVM') # ROC + confusion matrix test data
-learning_curve(SVM, ticker) # learning cruve
+    return data;
+# Risk metrics of many backtests at once: returns are a (strategies, time) matrix of per-bar returns, one row per backtest,
+# annualized over PERIODS_PER_YEAR bars (means times the periods, deviations times their square root)
+PERIODS_PER_YEAR = 250
+# float (strategies, time) matrix of returns or positions, a single series is one row
+def return_matrix(returns):
+    returns = np.asarray(returns, dtype = float)
+    return returns.reshape(1, -1) if returns.ndim == 1 else returns
+# wealth of one unit starting at 1, returns added up as the backtests do (the same amount is invested at each bar)
+def wealth_curve(returns):
+    returns = return_matrix(returns)
+    wealth = np.ones((returns.shape[0], returns.shape[1] + 1))
+    np.cumsum(returns, axis = 1, out = wealth[:, 1:])
+    wealth[:, 1:] += 1
+    return wealth
+# largest fall of the wealth curve from its running peak, as a fraction of the peak (the peak is at least the starting 1)
+def max_drawdown(returns):
+    wealth = wealth_curve(returns)
+    return np.max(1 - wealth / np.maximum.accumulate(wealth, axis = 1), axis = 1)
+# a / b, nan where b is 0 (flat series)
+def safe_ratio(a, b):
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), np.nan)
+# one row per backtest: annualized return (compounded from the wealth curve, -100% once it is all lost), volatility,
+# Sharpe (mean over standard deviation), downside deviation below the target return per bar and Sortino, max drawdown,
+# Calmar (annualized return over max drawdown), hit rate (share of the bars in the market that gain) and turnover
+# (position changes per year, positions: same shape as returns, nan without)
+def risk_metrics(returns, positions = None, target = 0, periods = PERIODS_PER_YEAR, names = None):
+    returns = return_matrix(returns)
+    length = returns.shape[1]
+
+    mean = returns.mean(axis = 1)
+    volatility = returns.std(axis = 1) * np.sqrt(periods)
+    downside = np.sqrt(np.mean(np.minimum(returns - target, 0) ** 2, axis = 1) * periods)
+    annual_return = np.maximum(wealth_curve(returns)[:, -1], 0) ** (periods / length) - 1
+    drawdown = max_drawdown(returns)
+
+    traded = returns != 0
+    hit_rate = safe_ratio((returns > 0).sum(axis = 1), traded.sum(axis = 1))
+    turnover = np.full(len(returns), np.nan) if positions is None else \
+               np.abs(np.diff(return_matrix(positions), axis = 1)).sum(axis = 1) * periods / length
+
+    table = pd.DataFrame({'annual_return': annual_return, 'volatility': volatility,
+                          'sharpe': safe_ratio(mean * periods, volatility),
+                          'downside_deviation': downside, 'sortino': safe_ratio((mean - target) * periods, downside),
+                          'max_drawdown': drawdown, 'calmar': safe_ratio(annual_return, drawdown),
+                          'hit_rate': hit_rate, 'turnover': turnover, 'bars': length})
+
+    return table.set_axis(range(len(table)) if names is None else list(names))
+# sums of every window of n consecutive bars of each row, from prefix sums along time (window_sum of a matrix)
+def row_window_sum(x, n):
+    prefix = np.zeros((x.shape[0], x.shape[1] + 1))
+    np.cumsum(x, axis = 1, out = prefix[:, 1:])
+    return prefix[:, n:] - prefix[:, : prefix.shape[1] - n]
+# the risk metrics of every window of n bars ending at each bar (from bar n - 1 on), each a (strategies, time - n + 1) array:
+# running sums of the returns, their squares, downside squares and gains, so the cost does not depend on n
+def rolling_risk(returns, n, target = 0, periods = PERIODS_PER_YEAR):
+    returns = return_matrix(returns)
+    centered = returns - returns.mean(axis = 1, keepdims = True) # same variance, smaller squares to subtract
+
+    mean = row_window_sum(returns, n) / n
+    variance = row_window_sum(centered ** 2, n) / n - (row_window_sum(centered, n) / n) ** 2
+    volatility = np.sqrt(np.maximum(variance, 0) * periods)
+    downside = np.sqrt(row_window_sum(np.minimum(returns - target, 0) ** 2, n) / n * periods)
+
+    return {'mean': mean * periods, 'volatility': volatility, 'sharpe': safe_ratio(mean * periods, volatility),
+            'downside_deviation': downside, 'sortino': safe_ratio((mean - target) * periods, downside),
+            'hit_rate': safe_ratio(row_window_sum(returns > 0, n), row_window_sum(returns != 0, n))}
+# compares rolling_risk with risk_metrics of each window, returns the largest gap per metric
+def rolling_risk_parity(returns, n, target = 0, atol = 1e-9):
+    returns = return_matrix(returns)
+    rolling = rolling_risk(returns, n, target)
+    gap = {}
+
+    for end in range(n, returns.shape[1] + 1):
+        window = risk_metrics(returns[:, end - n : end], target = target)
+        window['mean'] = returns[:, end - n : end].mean(axis = 1) * PERIODS_PER_YEAR
+
+        for key, values in rolling.items():
+            a, b = values[:, end - n], window[key].to_numpy()
+            assert np.allclose(a, b, rtol = 0, atol = atol, equal_nan = True), key
+            gap[key] = max(gap.get(key, 0), np.nanmax(np.abs(a - b), initial = 0))
+
+    return pd.Series(gap)
+# risk metrics of the strategy (realized returns) and of the market, each over its own bars: one row each
+def backtest_risk(data, market_data, target = 0):
+    return pd.concat([risk_metrics(data['realized_returns'], target = target, names = ['asset']),
+                      risk_metrics(market_data['%returns'], target = target, names = ['market'])])
+# Sharpe ratio
+@traced
+def sharpe(data, market_data):
+    table = backtest_risk(data, market_data)
 
-data_test['pred'] = pred_class_test # adding predictions as 0/1 to the dataframe
-data_test = accuracy(data_test) # Counts the number of time the model is right/wrong
+    print("E[R_m]: ", round(table.loc['market', 'annual_return'], 2))
+    print("E[R_i]: ", round(table.loc['asset', 'annual_return'], 2))
+    print("Volatility market: ", round(table.loc['market', 'volatility'], 2))
+    print("Volatility asset: ", round(table.loc['asset', 'volatility'], 2))
+    print("Sharpe market: ", round(table.loc['market', 'sharpe'], 2))
+    print("Sharpe asset: ", round(table.loc['asset', 'sharpe'], 2))
 
-# RBF kernel SVM
-grid = {
-	'C': [0.001, 0.01, 0.1, 1, 10, 100],
-	'gamma': [10, 1, 0.1, 0.01, 0.001, 0.0001, 0.00001],
-	'kernel': ['rbf']} # grid of values to evaluate
+    return table[['annual_return', 'volatility', 'sharpe']]
+# Sortino ratio
+@traced
+def sortino(data, market_data, T):
+    table = backtest_risk(data, market_data, T)
 
-rbf_SVM = svm.SVC(max_iter = 1000)
-grid_search = GridSearchCV(rbf_SVM, param_grid = grid, refit = True)
-rbf_SVM_fit = grid_search.fit(X, y)
-pred_class = grid_search.predict(X)
-pred_class_test = grid_search.predict(X_test)
+    print("sigma down asset: ", round(table.loc['asset', 'downside_deviation'], 2))
+    print("sigma down market: ", round(table.loc['market', 'downside_deviation'], 2))
+    print("sortino asset: ", round(table.loc['asset', 'sortino'], 2))
+    print("sortino market: ", round(table.loc['market', 'sortino'], 2))
 
-print(grid_search.best_params_) # displays the best set of parameters
+    return table[['downside_deviation', 'sortino']]
+# Out-of-core pipeline: features() and vec_profits() of a series too long for memory (tick or minute bars), read from and
+# written to disk chunk by chunk. The windows of a chunk read the last bars of the chunk before again, every scan (prefix
+# and cumulative sums, Wilder filter, dx average, capped growth) carries its state over, so the output is byte for byte
+# the in-memory one (both take the numpy DMI passes, vec_DMI's default) and memory is bounded by the chunk size
 
-roc(y, pred_class, grid_search, ticker, 'Kernel SVM') # ROC + confusion matrix train data
-roc(y_test, pred_class_test, grid_search, ticker, 'Kernel SVM') # ROC + confusion matrix test data
-learning_curve(rbf_SVM, ticker) # learning curve
 
-data_test['pred'] = pred_class_test # adding predictions as 0/1 to the dataframe
-data_test = accuracy(data_test) # Counts the number of time the model is right/wrong
+# cumulative sums of x continued from carry, the last sum of the chunk before (None on the first chunk)
+def carried_cumsum(x, carry = None):
+    if carry is None:
+        return np.cumsum(x)
+    return np.cumsum(np.concatenate([[carry], x]))[1:]
 
-# Profits
-amount = 1000
 
-backtest = profits(data_test, amount) # computes profits made with specified initial investment
-backtest_SP = profits_SP(data_SP_test, amount) # same for S&P
+# running_sum of a series pushed chunk by chunk: push(x) returns the sums of the windows of n values ending on the
+# values of x (none before the n-th value, the state is carried until then), the prefix sums go on from the last n ones
+class RunningSums(StreamingState):
 
-sharpe(backtest, backtest_SP)
-sortino(backtest, backtest_SP, 0)
+    def __init__(self, n):
+        self.n = n
+        self.prefix = None # last prefix sums of the values (non-finite ones as 0) and of the non-finite counts
+        self.bad = None
+        self.values = np.zeros(0) # last n - 1 values, for the windows holding a non-finite value
 
-# benchmark profits
-backtest_bench = profits_SP(data_test, amount)
+    def push(self, x):
+        x = np.asarray(x, dtype = float)
+        finite = np.isfinite(x)
+        clean = np.where(finite, x, 0)
 
-sharpe(backtest, backtest_bench)
-sortino(backtest, backtest_bench, 0)
+        if self.prefix is None:
+            prefix, bad = prefix_sum(clean), prefix_sum(~finite)
+        else:
+            prefix = np.concatenate([self.prefix, carried_cumsum(clean, self.prefix[-1])])
+            bad = np.concatenate([self.bad, carried_cumsum(~finite, self.bad[-1])])
+        values = np.concatenate([self.values, x])
+
+        self.prefix, self.bad = prefix[-self.n:], bad[-self.n:]
+        self.values = values[max(0, len(values) - (self.n - 1)):]
+
+        if len(prefix) <= self.n: # fewer than n values so far
+            return np.zeros(0)
+
+        sums = window_sum(prefix, self.n)
+        broken = window_sum(bad, self.n) > 0
+        if broken.any():
+            sums[broken] = sliding_window_view(values, self.n)[broken].sum(axis = 1)
+
+        return sums
+
+
+# wilder of a series pushed chunk by chunk: the first n values are kept until their sum, then the filter state is carried
+class WilderStream(StreamingState):
+
+    def __init__(self, n):
+        self.n = n
+        self.a = 1 - (1 / n)
+        self.seen = 0
+        self.head = []
+        self.state = None
+
+    def push(self, x):
+        start = self.seen
+        self.seen += len(x)
+        smooth = np.zeros(len(x))
+
+        if start < self.n:
+            self.head.append(x[: self.n - start])
+        if start <= self.n < self.seen:
+            total = np.concatenate(self.head).sum() # bar n itself is not smoothed in, as in wilder
+            smooth[self.n - start] = total
+            self.state = [self.a * total]
+
+        later = max(0, self.n + 1 - start)
+        if later < len(x):
+            smooth[later:], self.state = signal.lfilter([1], [1, -self.a], x[later:], zi = self.state)
+
+        return smooth
+
+
+# indicator_arrays of a series pushed chunk by chunk: push(bars) takes a dict of 'High', 'Low', 'Adj Close' and 'Volume'
+# arrays (other columns, e.g. 'Date', are passed through) and returns the bars whose indicators are final, in order;
+# the adx average reaches up to n - 6 bars ahead (see ADX_smooth), so the last bars of a chunk come out with the next
+# one, and finish() returns the rest once the series is over (with adx_causal every bar comes out with its chunk)
+# last: (high, low) of the last bar of the series, bar 0's movement is taken against it (see ADX_inputs)
+class ChunkedIndicators(StreamingState):
+
+    prices = ['High', 'Low', 'Adj Close', 'Volume']
+
+    def __init__(self, last, params = None):
+        self.p = indicator_params(params)
+        self.last_high, self.last_low = last
+        self.keep = max(self.p['rsi'], self.p['so'], self.p['ma'], self.p['macd_small'], self.p['macd_large']) + 1 # longest window
+        self.least = max(self.keep, indicator_warmup(self.p), self.p['adx_length']) + 1 # shortest chunk: windows, %D and ADX warm-up
+        self.seen = 0
+        self.tail = None # last `keep` bars, read again by the windows of the next chunk
+        self.reference = None # first close, the Bollinger sums are centered on it
+        self.D = RunningSums(self.p['ma_so'] + 1)
+        self.MACD = {'MACD_short': None, 'MACD_long': None} # running totals
+        self.true_range = 0.0 # last non-zero true range
+        self.plus = WilderStream(self.p['adx_length'])
+        self.minus = WilderStream(self.p['adx_length'])
+        self.dx = RunningSums(self.p['adx_length'])
+        self.OBV = None
+
+        # dx starts with five zeros, the adx of the first n bars is 0 (causal: n - 1 zeros before the dx of bar n)
+        n = self.p['adx_length']
+        if self.p['adx_causal']:
+            self.dx.push(np.zeros(n - 1))
+            self.pending = {'adx': np.zeros(n)}
+        else:
+            self.pending = {'adx': np.concatenate([np.zeros(n), (1 / n) * self.dx.push(np.zeros(5))])}
+
+    def push(self, bars):
+        p = self.p
+        count = len(bars['Adj Close'])
+        start = self.seen
+        self.seen += count
+
+        if self.tail is None:
+            self.tail = {name: np.asarray(bars[name], dtype = float)[:0] for name in self.prices}
+            self.reference = bars['Adj Close'][0]
+
+        # the chunk after the kept bars: bar `start` of the series is at h
+        ext = {name: np.concatenate([self.tail[name], np.asarray(bars[name], dtype = float)]) for name in self.prices}
+        h = len(self.tail['Adj Close'])
+        self.tail = {name: values[max(0, len(values) - self.keep):] for name, values in ext.items()}
+        high, low, close, volume = ext['High'], ext['Low'], ext['Adj Close'], ext['Volume']
+
+        out = {name: values for name, values in bars.items() if name not in ('High', 'Low', 'Volume')} # close and passed columns
+        out['RSI'] = vec_RSI(close, p['rsi'])[h:]
+
+        # %K on the window of the bar, its average from the running sums
+        n, d = p['so'], p['ma_so']
+        highest = rolling_extreme(high if p['so_high_low'] else close, n + 1, np.maximum)
+        lowest = rolling_extreme(low if p['so_high_low'] else close, n + 1, np.minimum)
+        K = np.full(len(close), np.nan)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            K[n:] = ((close[n:] - lowest) / (highest - lowest)) * 100
+        sums = self.D.push(K[h + max(0, n - start):])
+        out['D'] = np.full(count, np.nan)
+        out['D'][count - len(sums):] = (1 / d) * sums
+
+        out['MA'], out['boll_up'], out['boll_dw'] = (values[h:] for values in vec_boll(close, p['sd_boll'], p['ma'], self.reference))
+
+        # windows ending on the close before each bar, added to the running totals
+        for name, n in [('MACD_short', p['macd_small']), ('MACD_long', p['macd_large'])]:
+            sums = rolling_sum(close[:-1], n)[max(h, n) - n:]
+            out[name] = np.full(count, np.nan)
+            if len(sums) > 0:
+                total = carried_cumsum(sums, self.MACD[name])
+                self.MACD[name] = total[-1]
+                out[name][count - len(total):] = (1 / (p['macd_small'] + 1)) * total
+
+        # ADX_inputs and ADX_smooth, bar 0 of the series keeps a zero true range and directional indicators
+        n = p['adx_length']
+        bar_range = np.zeros(len(close))
+        bar_range[1:] = np.maximum.reduce([np.abs(high[1:] - low[1:]),
+                                           np.abs(high[1:] - close[:-1]),
+                                           np.abs(low[1:] - close[:-1])])
+        bar_range = bar_range[h:]
+        filled = np.maximum.accumulate(np.where(bar_range != 0, np.arange(count), -1)) # a zero range carries the previous one forward
+        true_range = np.where(filled >= 0, bar_range[filled], self.true_range)
+        self.true_range = true_range[-1]
+
+        up = np.empty(len(close))
+        down = np.empty(len(close))
+        up[1:] = high[1:] - high[:-1]
+        down[1:] = low[:-1] - low[1:]
+        if h == 0:
+            up[0] = 0 if p['adx_causal'] else high[0] - self.last_high
+            down[0] = 0 if p['adx_causal'] else self.last_low - low[0]
+        up, down = up[h:], down[h:]
+
+        smooth_plus = self.plus.push(np.where(up > down, up, 0))
+        smooth_minus = self.minus.push(np.where(up > down, 0, down))
+
+        out['DI_plus'] = np.zeros(count)
+        out['DI_minus'] = np.zeros(count)
+        later = slice(1 if start == 0 else 0, count)
+        first = max(0, n - start)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            out['DI_plus'][later] = (smooth_plus[later] / true_range[later]) * 100
+            out['DI_minus'][later] = (smooth_minus[later] / true_range[later]) * 100
+
+            dx = (np.abs((out['DI_plus'][first:] - out['DI_minus'][first:]) / (out['DI_plus'][first:] + out['DI_minus'][first:]))) * 100
+
+        adx = (1 / n) * self.dx.push(dx)
+
+        diff = close[1:] - close[:-1]
+        moves = np.where(diff > 0, volume[1:], np.where(diff < 0, -volume[1:], 0))[max(h, 1) - 1:]
+        out['OBV'] = np.zeros(count, dtype = volume.dtype)
+        if len(moves) > 0:
+            total = carried_cumsum(moves, self.OBV)
+            self.OBV = total[-1]
+            out['OBV'][count - len(total):] = total
+
+        return self.release(out, adx)
+
+    # the dx of the last bars is followed by the zero padding, the adx averages past the last bar are dropped
+    def finish(self):
+        n = self.p['adx_length']
+        adx = (1 / n) * self.dx.push(np.zeros(0 if self.p['adx_causal'] else max(0, n - 5)))
+        self.pending['adx'] = np.concatenate([self.pending['adx'], adx])[: len(self.pending['Adj Close'])]
+
+        return self.release({}, np.zeros(0))
+
+    # the pending bars with every column, the others wait for their adx
+    def release(self, out, adx):
+        for name, values in dict(out, adx = adx).items():
+            self.pending[name] = np.concatenate([self.pending[name], values]) if name in self.pending else values
+
+        ready = min(len(values) for values in self.pending.values())
+        released = {name: values[:ready] for name, values in self.pending.items()}
+        self.pending = {name: values[ready:] for name, values in self.pending.items()}
+
+        return released
+
+
+# features() rows of the bars released by a ChunkedIndicators: the signals of a row compare it with the row before, kept
+# from the chunk before; every one-hot column a rule can give is written, those whose code never occurs are dropped at the end
+class ChunkedFeatures(StreamingState):
+
+    def __init__(self, params = None, compact = False, extra = ()):
+        self.warmup = indicator_warmup(indicator_params(params))
+        self.compact = compact
+        self.extra = list(extra)
+        self.seen = 0
+        self.last = None # close and date of the last bar, the price and date of the next row
+        self.previous = None # operands of the last row
+        self.signals = []
+        for name, rule in SIGNAL_RULES.items():
+            for code in np.union1d(signal_table(rule), [rule['first']] if 'first' in rule else []):
+                if code != rule['dropped']:
+                    self.signals.append((name + '_' + str(code), name, code))
+        self.occurs = set()
+
+    # columns of features() in its order, with the signals that occurred
+    def columns(self):
+        return ['Adj Close', 'position', 'adx', 'OBV'] + self.extra + [col for col, name, code in self.signals if col in self.occurs]
+
+    def push(self, bars):
+        count = len(bars['Adj Close'])
+        start = self.seen
+        self.seen += count
+
+        if count == 0:
+            return None
+
+        # encode pairs the close and date of bar p - 1 with the indicators of bar p
+        shifted = {name: np.concatenate([bars[name][:1] if self.last is None else self.last[name], bars[name][:-1]])
+                   for name in ['Adj Close', 'Date'] if name in bars}
+        self.last = {name: bars[name][-1:] for name in shifted}
+
+        first = max(0, self.warmup - start)
+        if first >= count:
+            return None
+
+        ind = {name: values[first:] for name, values in bars.items() if name not in ('Adj Close', 'Date')}
+        operands = dict(ind, price = shifted['Adj Close'][first:], next = bars['Adj Close'][first:])
+
+        skip = 0 if self.previous is None else 1
+        if skip:
+            operands = {name: np.concatenate([self.previous[name], values]) for name, values in operands.items()}
+        self.previous = {name: values[-1:] for name, values in operands.items()}
+
+        position = signal_codes(LABEL_RULE, operands)[skip:].astype(np.int64)
+        codes = {name: signal_codes(rule, operands)[skip:] for name, rule in SIGNAL_RULES.items()}
+
+        rows = {'Date': shifted['Date'][first:]} if 'Date' in shifted else {}
+        if self.compact:
+            rows.update({'Adj Close': shifted['Adj Close'][first:], 'position': position.astype(np.int8),
+                         'adx': ind['adx'].astype(np.float32), 'OBV': ind['OBV'].astype(np.float32)})
+        else:
+            rows.update({'Adj Close': shifted['Adj Close'][first:], 'position': position, 'adx': ind['adx'], 'OBV': ind['OBV']})
+        rows.update({col: ind[col].astype(np.float32) if self.compact else ind[col] for col in self.extra})
+
+        for col, name, code in self.signals:
+            rows[col] = (codes[name] == code).astype(np.uint8 if self.compact else np.float64)
+            if rows[col].any():
+                self.occurs.add(col)
+
+        return rows
+# file of a column written by chunked_features / chunked_backtest
+def chunked_file(directory, name):
+    return os.path.join(directory, quote(name, safe = '') + '.npy')
+# columns.json of directory: the columns in order, written next to the old one then renamed
+def write_chunked_meta(directory, meta):
+    with open(os.path.join(directory, 'tmp_columns.json'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(directory, 'tmp_columns.json'), os.path.join(directory, 'columns.json'))
+def read_chunked_meta(directory):
+    with open(os.path.join(directory, 'columns.json')) as f:
+        return json.load(f)
+# features() of the series in folder (CachedSource layout: dates.npy and the float64 prices.npy in PRICE_COLUMNS order,
+# memory-mapped), chunk bars at a time, into directory: one .npy file per column (Date first) and columns.json
+# predict(X) -> class of every row of a chunk's model matrix adds a 'pred' column; X has a column for every signal the
+# rules can give, selecting the training columns (feature_schema) is up to predict
+@traced
+def chunked_features(folder, directory, chunk = 2 ** 20, params = None, compact = False, extra = (), predict = None):
+    dates = np.load(os.path.join(folder, 'dates.npy'), mmap_mode = 'r')
+    prices = np.load(os.path.join(folder, 'prices.npy'), mmap_mode = 'r')
+    position = {name: j for j, name in enumerate(PRICE_COLUMNS)}
+
+    stream = ChunkedIndicators((prices[-1, position['High']], prices[-1, position['Low']]), params)
+    rows = ChunkedFeatures(params, compact, extra)
+
+    if chunk < stream.least:
+        raise ValueError('chunks of at least ' + str(stream.least) + ' bars are needed for the indicator warm-ups')
+
+    os.makedirs(directory, exist_ok = True)
+    length = max(0, len(dates) - rows.warmup)
+    files = {}
+    written = 0
+
+    for start in list(range(0, len(dates), chunk)) + [None]:
+        if start is None:
+            out = rows.push(stream.finish())
+        else:
+            block = prices[start : start + chunk]
+            bars = {name: block[:, position[name]] for name in ChunkedIndicators.prices}
+            bars['Date'] = np.array(dates[start : start + chunk])
+            out = rows.push(stream.push(bars))
+
+        if out is None:
+            continue
+
+        if predict is not None:
+            out['pred'] = np.asarray(predict(pd.DataFrame({col: values for col, values in out.items()
+                                                           if col not in ('Date', 'Adj Close', 'position')})))
+
+        for name, values in out.items():
+            if name not in files:
+                files[name] = np.lib.format.open_memmap(chunked_file(directory, name), mode = 'w+', dtype = values.dtype, shape = (length,))
+            files[name][written : written + len(values)] = values
+        written += len(out['Adj Close'])
+
+    for name, values in files.items():
+        values.flush()
+
+    # signals that never occurred have no column in features()
+    columns = rows.columns() + (['pred'] if predict is not None else [])
+    for col, name, code in rows.signals:
+        if col not in columns and os.path.exists(chunked_file(directory, col)):
+            os.remove(chunked_file(directory, col))
+
+    write_chunked_meta(directory, {'columns': columns, 'rows': length, 'params': indicator_params(params), 'compact': compact})
+
+    return columns
+# vec_profits of the closes and predictions ('pred', else the labels) written by chunked_features, chunk rows at a time,
+# its columns are added to directory; capped_growth picks its branch on the whole series, so a first pass reads the growths
+@traced
+def chunked_backtest(directory, amount, chunk = 2 ** 20, pred = None):
+    meta = read_chunked_meta(directory)
+    pred = pred if pred is not None else 'pred' if 'pred' in meta['columns'] else 'position'
+    close = np.load(chunked_file(directory, 'Adj Close'), mmap_mode = 'r')
+    preds = np.load(chunked_file(directory, pred), mmap_mode = 'r')
+    length = len(close)
+    steps = length - 1 # rows with a return
+
+    # returns and market exposure of the rows start .. start + chunk that have a return
+    def returns(start):
+        stop = min(start + chunk, steps)
+        return log_returns(np.asarray(close[start : stop + 1], dtype = float)), np.asarray(preds[start : stop]) != 0
+
+    positive = all(((1 + rate * invest) > 0).all() for rate, invest in map(returns, range(0, steps, chunk)))
+
+    # capital is committed on the first buy, but a sell signal on bar 1 before any buy empties it (see profits_loop)
+    head = np.asarray(preds[: min(2, steps)]) != 0
+    funded = head.any()
+    first = 0 if head[0] else 1
+
+    keys = ['profits', 'available', 'invested', 'realized_profits', 'realized_returns', '%returns']
+    files = {key: np.lib.format.open_memmap(chunked_file(directory, key), mode = 'w+', dtype = np.float64, shape = (length,)) for key in keys}
+    S, top, y = None, None, amount # carried capped_growth state
+
+    for start in range(0, length, chunk):
+        stop = min(start + chunk, length)
+        rate, invest = returns(start)
+        growth = 1 + rate * invest
+
+        # capped_growth: total[0] is the capital at the start of bar `start`, total[-1] the one after the chunk
+        if positive:
+            S = np.concatenate([[0.0 if S is None else S[-1]], carried_cumsum(np.log(growth), None if S is None else S[-1])])
+            total_S = S[: stop - start]
+            running = np.maximum.accumulate(total_S if top is None else np.concatenate([[top], total_S]))[0 if top is None else 1:]
+            top = running[-1]
+            total = amount * np.exp(total_S - running)
+        else:
+            total = np.empty(len(growth) + 1)
+            total[0] = y
+            for p in range(len(growth)):
+                total[p + 1] = np.minimum(total[p] * growth[p], amount)
+            y = total[-1]
+            total = total[: stop - start]
+
+        m = len(rate)
+        out = {key: np.zeros(stop - start) for key in keys}
+        out['%returns'][:m] = rate
+
+        capital = total[:m] * (funded & (np.arange(start, start + m) >= first)) # capital at the start of each bar
+        profit = np.multiply(capital * rate, invest, out = out['profits'][:m])
+        after = capital + profit
+
+        np.multiply(capital, ~invest, out = out['available'][:m])
+        if start == 0:
+            out['available'][0] = amount * ~invest[0]
+        if stop == length:
+            out['available'][-1] = total[-1] * funded
+        np.multiply(after, invest, out = out['invested'][:m])
+        np.maximum(after - amount, 0, out = out['realized_profits'][:m])
+        np.multiply(rate, invest, out = out['realized_returns'][:m])
+
+        for key in keys:
+            files[key][start : stop] = out[key]
+
+    for key in keys:
+        files[key].flush()
+
+    meta['columns'] = [col for col in meta['columns'] if col not in keys] + keys
+    write_chunked_meta(directory, meta)
+
+    return files['available'][-1]
+# the columns of a chunked_features / chunked_backtest directory as a dataframe indexed by Date (read into memory)
+def read_chunked(directory, columns = None):
+    columns = read_chunked_meta(directory)['columns'] if columns is None else columns
+    dates = np.load(chunked_file(directory, 'Date'), mmap_mode = 'r')
+
+    return pd.DataFrame({name: np.load(chunked_file(directory, name), mmap_mode = 'r') for name in columns},
+                        index = pd.DatetimeIndex(dates, name = 'Date'))
+# checks the chunked pipeline against features() and vec_profits() on the whole series of folder, byte for byte and with
+# the same dtypes, prints the peak memory of both paths
+def chunked_parity(folder, chunk = 2 ** 16, amount = 1000, params = None, compact = False):
+    directory = tempfile.mkdtemp(prefix = 'chunked_parity_')
+
+    def in_memory():
+        data = pd.DataFrame(np.load(os.path.join(folder, 'prices.npy'), mmap_mode = 'r'), columns = PRICE_COLUMNS, copy = False)
+        full = features(data, compact, params)
+        return full, vec_profits(full['Adj Close'].to_numpy(), full['position'].to_numpy(), amount)
+
+    def chunked():
+        chunked_features(folder, directory, chunk, params, compact)
+        chunked_backtest(directory, amount, chunk)
+
+    try:
+        (full, backtest), memory_peak = peak_memory(in_memory)
+        chunked_peak = peak_memory(chunked)[1]
+        out = read_chunked(directory)
+
+        assert list(out.columns) == list(full.columns) + list(backtest), list(out.columns)
+        for col, values in list(full.items()) + list(backtest.items()):
+            a, b = out[col].to_numpy(), np.asarray(values)
+            assert a.dtype == b.dtype and a.tobytes() == b.tobytes(), col
+
+        dates = np.load(os.path.join(folder, 'dates.npy'), mmap_mode = 'r')
+        assert (out.index.values == dates[len(dates) - 1 - len(out) : len(dates) - 1]).all()
+    finally:
+        shutil.rmtree(directory)
+
+    print('peak memory in memory : ', round(memory_peak, 2), 'MB  chunked : ', round(chunked_peak, 2), 'MB')
+
+    return memory_peak, chunked_peak
+# command line of the chunked mode
+def chunked_main(argv):
+    parser = argparse.ArgumentParser(prog = 'PyProject.py chunked', description = 'features and backtest of a long series, chunk by chunk on disk')
+    parser.add_argument('bars', help = 'folder of the series in the CachedSource layout (CachedSource.folder, e.g. data_cache/AF.PA/<version>)')
+    parser.add_argument('out', help = 'folder for the output columns (.npy files)')
+    parser.add_argument('--chunk', type = int, default = 2 ** 20, help = 'bars per chunk')
+    parser.add_argument('--amount', type = int, default = 1000, help = 'initial investment of the backtest')
+    parser.add_argument('--compact', action = 'store_true', help = 'uint8 signals, float32 adx/OBV and int8 labels')
+    parser.add_argument('--parity', action = 'store_true', help = 'also checks the output against the in-memory path')
+    args = parser.parse_args(argv)
+
+    columns = chunked_features(args.bars, args.out, args.chunk, compact = args.compact)
+    capital = chunked_backtest(args.out, args.amount, args.chunk)
+    print(read_chunked_meta(args.out)['rows'], 'rows,', len(columns), 'feature columns, final capital', round(float(capital), 2))
+
+    if args.parity:
+        chunked_parity(args.bars, args.chunk, args.amount, compact = args.compact)
+
+    return 0
+# Benchmarks on synthetic data, offline and CPU only: python PyProject.py benchmark --help
+# seeded random walk of OHLCV bars (business days, minutes beyond 50k bars so the dates stay in range)
+def synthetic_ohlcv(bars, seed = 0):
+    rng = np.random.default_rng(seed)
+
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+    spread = np.abs(rng.normal(0, 0.01, (2, bars)))
+    index = pd.date_range('2000-01-03', periods = bars, freq = 'B' if bars <= 50000 else 'min', name = 'Date')
+
+    return pd.DataFrame({'High': close * (1 + spread[0]), 'Low': close * (1 - spread[1]), 'Open': close, 'Close': close,
+                         'Volume': rng.integers(10 ** 4, 10 ** 7, bars), 'Adj Close': close}, index = index)
+# data source of synthetic bars, seeded by the ticker so every run sees the same series
+class SyntheticSource:
+
+    def __init__(self, bars):
+        self.bars = bars
+
+    def __call__(self, ticker, start, end):
+        return synthetic_ohlcv(self.bars, zlib.crc32(ticker.encode()))
+# model matrix and labels of a synthetic series, scaled like the script does
+def _bench_matrix(bars):
+    data, data_test, X, y, X_test, y_test = test_train_split(features(synthetic_ohlcv(bars)), 0.7)
+    return preprocessing.MinMaxScaler(feature_range = [0, 1]).fit_transform(X), y.to_numpy()
+# backtest frame of a synthetic series, predictions are the labels so the returns stay positive for sharpe()
+def _bench_backtest(bars):
+    data = features(synthetic_ohlcv(bars))[['Adj Close', 'position']]
+    data['pred'] = data['position']
+    return data
+def _bench_panel(tickers, bars):
+    names = ['T' + str(i) for i in range(tickers)]
+    return lambda: panel(names, None, None, loader = SyntheticSource(bars))
+def _bench_sharpe_sortino(bars):
+    data = _bench_backtest(bars)
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = profits(data.copy(), 1000)
+        market = profits_SP(data.copy(), 1000)
+    return lambda: (sharpe(backtest, market), sortino(backtest, market, 0))
+# returns of 100 synthetic backtests (strategies, bars), a third of the bars out of the market
+def _bench_returns(bars):
+    returns = np.random.default_rng(0).normal(0.0003, 0.01, (100, bars))
+    returns[:, ::3] = 0
+    return returns
+def _bench_fit_nn(bars):
+    X, y = _bench_matrix(bars)
+    return lambda: NeuralNet().fit(X, y, epochs = 1, verbose = 0)
+# one epoch of fast_fit (compiled once in the setup), against fit_nn_epoch's default batches of 32
+def _bench_fit_nn_fast(bars):
+    X, y = _bench_matrix(bars)
+    model = NeuralNet(jit_compile = True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fast_fit(model, X, y, epochs = 1, validation = 0)
+    return lambda: fast_fit(model, X, y, epochs = 1, validation = 0)
+# ADX, +DI and -DI of a synthetic series (numpy passes, or the numba kernel with jit = True)
+def _bench_DMI(bars, jit = False):
+    data = synthetic_ohlcv(bars)
+    vec_DMI(data['High'].to_numpy(), data['Low'].to_numpy(), data['Adj Close'].to_numpy(), 14, jit) # compiles the kernel, imports scipy
+    return partial(vec_DMI, data['High'].to_numpy(), data['Low'].to_numpy(), data['Adj Close'].to_numpy(), 14, jit)
+# 27 parameter sets: sweep in one pass against one indicators() call per set
+SWEEP_BENCH_GRID = parameter_grid(rsi = [7, 9, 14], so = [10, 14, 21], ma = [10, 20, 30])
+def _bench_sweep_loop(bars):
+    data = synthetic_ohlcv(bars)
+    def loop():
+        frames = [indicators(data, p).to_numpy() for p in SWEEP_BENCH_GRID]
+        rows = min(len(frame) for frame in frames)
+        return np.stack([frame[len(frame) - rows:] for frame in frames])
+    return loop
+# temporary folders of the case being timed, removed by run_benchmarks once it is done
+_bench_directories = []
+def _bench_directory(prefix):
+    directory = tempfile.mkdtemp(prefix = prefix)
+    _bench_directories.append(directory)
+    return directory
+# features read back from a warm FeatureStore (the model-iteration path)
+def _bench_feature_store(bars):
+    data = synthetic_ohlcv(bars)
+    store = FeatureStore(_bench_directory('feature_store_'))
+    store(data)
+    return partial(store, data)
+# chunked_features + chunked_backtest of a synthetic series in the CachedSource layout, 2 ** 16 bars per chunk
+def _bench_chunked(bars):
+    data = synthetic_ohlcv(bars)
+    cache = CachedSource(None, _bench_directory('chunked_bars_'))
+    cache.write('bench', data, data.index[0], data.index[-1])
+    directory = _bench_directory('chunked_out_')
+    return lambda: (chunked_features(cache.folder('bench'), directory, 2 ** 16), chunked_backtest(directory, 1000, 2 ** 16))
+# seconds budget of `import PyProject` in a fresh interpreter (heavy libraries are LazyModule)
+COLD_IMPORT_TARGET = 0.5
+def _bench_cold_import(bars):
+    command = [sys.executable, '-c', 'import PyProject']
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return lambda: subprocess.run(command, cwd = directory, check = True)
+# stage: (setup(bars) -> function to time, largest number of bars it is run on)
+BENCH_STAGES = {
+    'indicators': (lambda bars: partial(indicators, synthetic_ohlcv(bars)), 10 ** 7),
+    'indicators_loop': (lambda bars: partial(indicators_loop, synthetic_ohlcv(bars)), 10 ** 3), # the loop MACD is quadratic
+    'features': (lambda bars: partial(features, synthetic_ohlcv(bars)), 10 ** 7),
+    'DMI': (_bench_DMI, 10 ** 7),
+    'stochastic': (lambda bars: partial(vec_oscill, synthetic_ohlcv(bars)['Adj Close'].to_numpy(), 14, 5), 10 ** 7),
+    'feature_store_hit': (_bench_feature_store, 10 ** 6),
+    'chunked': (_bench_chunked, 10 ** 7), # peak memory flat in the number of bars
+    'indicator_sweep': (lambda bars: partial(indicator_sweep, synthetic_ohlcv(bars), SWEEP_BENCH_GRID), 10 ** 6),
+    'indicator_sweep_loop': (_bench_sweep_loop, 10 ** 6),
+    'encode_transform': (lambda bars: lambda data = synthetic_ohlcv(bars): transform(encode(data.copy())), 10 ** 5),
+    'stream': (lambda bars: partial(stream_indicators, synthetic_ohlcv(bars)), 10 ** 5),
+    'profits': (lambda bars: lambda data = _bench_backtest(bars): profits(data.copy(), 1000), 10 ** 7),
+    'profits_loop': (lambda bars: lambda data = _bench_backtest(bars): profits_loop(data.copy(), 1000), 10 ** 4),
+    'sharpe_sortino': (_bench_sharpe_sortino, 10 ** 5),
+    'risk_metrics': (lambda bars: partial(risk_metrics, _bench_returns(bars)), 10 ** 5),
+    'rolling_risk': (lambda bars: partial(rolling_risk, _bench_returns(bars), 60), 10 ** 5),
+    'fit_logit': (lambda bars: lambda Xy = _bench_matrix(bars): sm.MNLogit(Xy[1], Xy[0]).fit(method = 'newton', maxiter = 100, disp = 0), 10 ** 6),
+    'fit_svm': (lambda bars: lambda Xy = _bench_matrix(bars): svm.SVC().fit(*Xy), 2 * 10 ** 4),
+    'fit_nn_epoch': (_bench_fit_nn, 10 ** 6),
+    'fit_nn_fast_epoch': (_bench_fit_nn_fast, 10 ** 6),
+    'cold_import': (_bench_cold_import, 10 ** 3), # does not depend on the size, run once
+}
+if importlib.util.find_spec('numba') is not None:
+    BENCH_STAGES['DMI_jit'] = (partial(_bench_DMI, jit = True), 10 ** 7)
+# best wall time of up to `repeats` runs (stops after ~2 s), CPU time of that run and peak traced memory of one more run
+def time_stage(func, repeats = 5):
+    best = None
+    spent = 0
+
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings(): # stages print their results
+        warnings.simplefilter('ignore')
+
+        for r in range(repeats):
+            t0, cpu0 = time.perf_counter(), time.process_time()
+            func()
+            wall, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+
+            if best is None or wall < best[0]:
+                best = (wall, cpu)
+
+            spent += wall
+            if spent > 2:
+                break
+
+        peak = peak_memory(func)[1]
+
+    return {'seconds': best[0], 'cpu_seconds': best[1], 'runs': r + 1, 'peak_mb': peak,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+# runs the selected stages on every size they support, returns the results as a list of records
+def run_benchmarks(stages = None, bars = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7), tickers = (1, 10, 100, 1000, 5000),
+                   panel_bars = 2500, repeats = 5):
+    stages = list(BENCH_STAGES) + ['panel'] if stages is None else stages
+    results = []
+
+    for stage in stages:
+        if stage == 'panel':
+            cases = [(panel_bars, n, partial(_bench_panel, n, panel_bars)) for n in tickers]
+        else:
+            setup, largest = BENCH_STAGES[stage]
+            cases = [(n, 1, partial(setup, n)) for n in bars if n <= largest]
+
+        for n_bars, n_tickers, setup in cases:
+            record = {'stage': stage, 'bars': n_bars, 'tickers': n_tickers}
+            try:
+                record.update(time_stage(setup(), repeats))
+            finally:
+                while _bench_directories:
+                    shutil.rmtree(_bench_directories.pop(), ignore_errors = True)
+            results.append(record)
+
+            print(stage, n_bars, n_tickers, round(record['seconds'], 4), 's', round(record['peak_mb'], 1), 'MB', flush = True)
+
+    return results
+# machine and code version the results were measured on
+def benchmark_meta():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'commit': commit, 'date': dt.datetime.now().isoformat(), 'platform': platform.platform(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'cpus': os.cpu_count(),
+            'cold_import_target': COLD_IMPORT_TARGET}
+# ratio of new to old timings per (stage, bars, tickers), flags the ones slower than threshold
+def compare_benchmarks(old, new, threshold = 1.2):
+    key = ['stage', 'bars', 'tickers']
+    old = pd.DataFrame(old['results']).set_index(key)
+    new = pd.DataFrame(new['results']).set_index(key)
+
+    table = pd.DataFrame({'old': old['seconds'], 'new': new['seconds']}).dropna()
+    table['ratio'] = table['new'] / table['old']
+    table['regression'] = table['ratio'] > threshold
+
+    return table
+# command line of the benchmark mode
+def benchmark_main(argv):
+    parser = argparse.ArgumentParser(prog = 'PyProject.py benchmark', description = 'pipeline benchmarks on synthetic OHLCV data')
+    parser.add_argument('--stages', default = None, help = 'comma separated, among: ' + ', '.join(list(BENCH_STAGES) + ['panel']))
+    parser.add_argument('--bars', default = '1000,10000,100000,1000000,10000000')
+    parser.add_argument('--tickers', default = '1,10,100,1000,5000')
+    parser.add_argument('--panel-bars', type = int, default = 2500)
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--out', default = None, help = 'json file for the results')
+    parser.add_argument('--compare', default = None, help = 'json file of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(None if args.stages is None else args.stages.split(','),
+                             [int(n) for n in args.bars.split(',')], [int(n) for n in args.tickers.split(',')],
+                             args.panel_bars, args.repeats)
+    report = {'meta': benchmark_meta(), 'results': results}
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent = 1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            table = compare_benchmarks(json.load(f), report)
+        print(table)
+        return int(table['regression'].any())
+
+    return 0
+
+# the experiment on one ticker: python PyProject.py [--ticker AF.PA] [--offline folder] [--trace trace.json] [--report folder]
+# python PyProject.py benchmark [options] runs the benchmarks instead, python PyProject.py serve [options] the scoring service,
+# python PyProject.py chunked <bars folder> <out folder> [options] the out-of-core features and backtest
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    # benchmark mode runs offline on synthetic data instead of the experiment
+    if len(argv) > 0 and argv[0] == 'benchmark':
+        return benchmark_main(argv[1:])
+
+    # scoring service on stdin / stdout from the saved models
+    if len(argv) > 0 and argv[0] == 'serve':
+        return serve_main(argv[1:])
+
+    # features and backtest of a series too long for memory, chunk by chunk on disk
+    if len(argv) > 0 and argv[0] == 'chunked':
+        return chunked_main(argv[1:])
+
+    parser = argparse.ArgumentParser(prog = 'PyProject.py', description = 'market predictability experiment on one ticker')
+    parser.add_argument('--ticker', default = 'AF.PA', help = 'Walmart:WMT - Apple:AAPL - AirFrance:AF.PA - Tesla:TSLA')
+    parser.add_argument('--offline', default = None, help = 'folder of <ticker>.csv files to use instead of the yahoo API')
+    parser.add_argument('--trace', default = None, help = 'json file for a chrome trace of the stages')
+    parser.add_argument('--report', default = None, help = 'folder for the figures as png files instead of showing them')
+    parser.add_argument('--fast', action = 'store_true', help = 'neural nets in large XLA batches with early stopping (fast_fit)')
+    parser.add_argument('--batch-size', type = int, default = FAST_FIT['batch_size'], help = 'batch size of --fast')
+    parser.add_argument('--models', default = 'model_registry', help = 'model registry the fitted models are reused from / stored in')
+    parser.add_argument('--causal-adx', action = 'store_true', help = 'adx from past bars only (adx_causal), needed to serve the models')
+    args = parser.parse_args(argv)
+
+    if args.trace is not None:
+        enable_trace(args.trace)
+
+    if args.report is not None:
+        enable_report(args.report)
+
+    # Display options
+    pd.set_option("display.max_rows", None, "display.max_columns", None)
+
+    #seed
+    seed(100)
+    tf.random.set_seed(100)
+
+    # Choosing assets
+    ticker = args.ticker #Walmart:WMT - Apple:AAPL - AirFrance:AF.PA - Tesla:TSLA
+    ticker_SP = '^GSPC' # ticker for the S&P500
+
+    start = dt.datetime(2010,8,1) # series starts on 2010/08/01
+    end = dt.datetime(2019,12,31) # ends on 2019/12/31
+
+    # importing data from yahoo API, through the local cache (or from csv files with --offline)
+    source = CachedSource(YahooSource(), 'data_cache') if args.offline is None else CSVSource(args.offline)
+    data = source(ticker, start, end)
+    data_SP = source(ticker_SP, start, end)
+
+    # plot of the serie
+    show_figure('line', 'price', [{'x': data.index.to_numpy(), 'y': [data['Adj Close'].to_numpy()], 'title': ticker,
+                                   'xlabel': 'Time', 'ylabel': 'Adj Close'}])
+
+    compact = False # True for a float32 / uint8 / int8 model matrix
+
+    feature_store = FeatureStore('feature_cache') # features of prices and parameters seen before are read back from disk
+    params = {'adx_causal': True} if args.causal_adx else None # indicator parameters, the study's by default
+    data = feature_store(data, compact, params) # encodes data into buy/sell, adds the indicators and transforms them into signals (encode + transform in one pass)
 
-plt.plot(data_test['profit'])
-plt.show
-plt.plot(data_test['realized_profits'])
-plt.show()
+    train_size = 0.7 # 70% of the data to training 30% to testing
 
-#LSTM
-def lstm():
-    for p in range(0, len(data)):
-        if data['position'][p] == 2:
-            data['position'][p] = 1
-        elif data['position'][p] == 3:
-            data['position'][p] = 0
+    # Spliting data into training and testing sets
+    data, data_test, X, y, X_test, y_test = test_train_split(data, train_size)
+    data_SP, data_SP_test = test_train_SP(data_SP, train_size)
 
-    scaler = MinMaxScaler(feature_range = [0, 1]).fit(X)
-    X = scaler.transform(X)
+    # position frequencies (test VS train)
+    show_figure('bars', 'positions', [position_bars(data, data_test, ticker)])
 
-    n = 14
-    Xtrain = []
-    ytrain = []
+    inputPlots(data) # plots of conditional distributions with respect to inputs
 
-    for p in range(n, len(X)):
-        Xtrain.append(X[p - n : p, : X.shape[1]])
-        ytrain.append(y[p])
+    # Logit, neural nets, linear and kernel SVM: features scaled once per split, the models fitted concurrently
+    fast = dict(FAST_FIT, batch_size = args.batch_size) if args.fast else None
+    registry = ModelRegistry(args.models) # models already fitted on the same data and settings are reloaded, not refitted
+    runs, predictions, scaler = train_models(X, y, X_test, y_test, fast = fast, registry = registry, run = ticker, params = params,
+                                           start = start)
+    print(runs.drop(['loss'], axis = 1))
 
-    Xtrain, ytrain = (np.array(Xtrain), np.array(ytrain))
-    Xtrain = np.reshape(Xtrain, (Xtrain.shape[0], Xtrain.shape[1], Xtrain.shape[2]))
+    for model_name, run in runs.iterrows():
+        pred_class = predictions.loc[(model_name, 'train'), 'pred'].to_numpy() # Predicted class on train data
+        pred_class_test = predictions.loc[(model_name, 'test'), 'pred'].to_numpy() # Predicted class on test data
+        figure = model_name.lower().replace(' ', '_')
 
+        roc(y, pred_class, model_name, ticker, model_name, 'roc_' + figure + '_train') # ROC + confusion matrix train data
+        roc(y_test, pred_class_test, model_name, ticker, model_name, 'roc_' + figure + '_test') # ROC + confusion matrix test data
+        learning_curve(None, ticker, 'loss_' + figure, run['loss']) # learning curve (neural nets)
 
-    def lstm_net():
-        model = Sequential()
-        model.add(LSTM(64, input_shape = (Xtrain.shape[1], Xtrain.shape[2])))
-        model.add(layers.Dense(1))
+        data_test['pred'] = pred_class_test # adding predictions as 0/1 to the dataframe, the last model's are backtested
+        data_test = accuracy(data_test) # Counts the number of time the model is right/wrong
 
-        model.compile(loss = keras.losses.BinaryCrossentropy(),
-                    metrics=keras.metrics.BinaryCrossentropy(),
-                    optimizer="adam")
+    # Profits
+    amount = 1000
 
-        return model
+    backtest = profits(data_test, amount) # computes profits made with specified initial investment
+    backtest_SP = profits_SP(data_SP_test, amount) # same for S&P
 
+    sharpe(backtest, backtest_SP)
+    sortino(backtest, backtest_SP, 0)
 
-    lstm = lstm_net()
+    # benchmark profits
+    backtest_bench = profits_SP(data_test, amount)
 
-    history = lstm.fit(Xtrain, ytrain, epochs = 100)
+    sharpe(backtest, backtest_bench)
+    sortino(backtest, backtest_bench, 0)
 
-    pred = lstm.predict(Xtrain) # Predicted probabilities on train data
-    pred_class = pred.argmax(axis = -1) # Predicted class on train data
+    show_figure('line', 'profits', [{'x': data_test.index.to_numpy(), 'y': [data_test['profit'].to_numpy(), data_test['realized_profits'].to_numpy()],
+                                     'title': ticker}])
 
-    results(ytrain, pred_class, lstm)
+    render_report() # headless report: every figure of the run at once
 
+    return 0
 
 
+if __name__ == '__main__':
+    sys.exit(main())
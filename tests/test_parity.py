@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PyProject
+
+# the loop references read bars by position through the index fallback pandas 3 removed
+loop_reference = pytest.mark.skipif(int(pd.__version__.split('.')[0]) >= 3, reason = 'loop references need pandas < 3')
+
+
+@pytest.fixture(scope = 'module')
+def data():
+    return PyProject.synthetic_ohlcv(600, seed = 1)
+
+
+@pytest.fixture
+def cached(data):
+    directory = tempfile.mkdtemp(prefix = 'test_parity_')
+    source = PyProject.CachedSource(None, directory)
+    source.write('T', data, data.index[0], data.index[-1])
+    yield source.folder('T')
+    shutil.rmtree(directory)
+
+
+@loop_reference
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_indicators_match_loop_version(data):
+    assert PyProject.indicators_parity(data).max() < 1e-8
+
+
+@loop_reference
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_features_match_encode_transform(data):
+    PyProject.features_parity(data)
+
+
+def test_backtests_match_loop_versions(data):
+    backtest = PyProject.features(data)[['Adj Close', 'position']]
+    backtest['pred'] = np.roll(backtest['position'].to_numpy(), 1) # wrong on some bars, so both signs of trade occur
+    assert PyProject.backtest_parity(backtest, 1000).max() < 1e-9
+
+
+def test_sweep_matches_indicators(data):
+    grid = PyProject.parameter_grid(rsi = [7, 9], so = [10, 14], ma = [10, 20], so_high_low = [False, True], adx_causal = [False, True])
+    assert PyProject.sweep_parity(data, grid).max() < 1e-8
+
+
+@pytest.mark.parametrize('params, compact', [(None, False), ({'ma': 40, 'so_high_low': True}, True), ({'adx_causal': True}, False)])
+def test_chunked_matches_in_memory(cached, params, compact):
+    PyProject.chunked_parity(cached, chunk = 90, params = params, compact = compact)
+
+
+def test_rolling_risk_matches_windows():
+    returns = np.random.default_rng(2).normal(0.0003, 0.01, (5, 200))
+    returns[:, ::3] = 0
+    assert PyProject.rolling_risk_parity(returns, 60).max() < 1e-9
+
+
+def test_latest_feature_row_matches_features(data):
+    params = PyProject.indicator_params({'adx_causal': True})
+    loader = lambda ticker, start, end: data[(data.index >= start) & (data.index <= end)]
+    columns = [col for col in PyProject.features(data, params = params).columns if col not in ['Adj Close', 'position']]
+    state = None
+
+    for end in data.index[[400, 401, 450, -1]]: # the stream is fed the bars since the request before
+        ticker, row, date, state, error = PyProject.latest_feature_row(('T', loader, data.index[0], end, state, params, [], columns))
+        assert error is None, error
+        expected = PyProject.features(loader('T', data.index[0], end), params = params).iloc[-1].reindex(columns, fill_value = 0)
+        assert date == end and np.allclose(row, expected.to_numpy(dtype = float), rtol = 1e-9, atol = 1e-9)